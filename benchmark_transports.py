@@ -0,0 +1,121 @@
+"""Benchmark - Round-trip latency of the server/client transports on one host.
+
+Each round trip sends a binary joint position command from the server side and
+waits for a binary robot state in reply from an echo process, as in a
+command/feedback cycle. Compares UDP loopback with Unix datagram sockets
+(TRANSPORTS can add 'tcp' and 'shm').
+"""
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import protocol
+from shm_transport import SharedMemoryTransport
+from transport import TcpTransport, UdpTransport, UnixDatagramTransport
+
+TRANSPORTS = ('udp', 'unix')
+ROUND_TRIPS = 20000
+WARMUP = 1000
+HOST = '127.0.0.1'
+SERVER_PORT = 5900
+CLIENT_PORT = 5901
+SOCKET_DIR = tempfile.gettempdir()
+
+
+def _socket_paths():
+    return (os.path.join(SOCKET_DIR, 'benchmark_server.sock'),
+            os.path.join(SOCKET_DIR, 'benchmark_client.sock'))
+
+
+def open_transport(name, server):
+    """Open the server or client end of a transport by name."""
+    if name == 'udp':
+        if server:
+            return UdpTransport(HOST, SERVER_PORT)
+        return UdpTransport(HOST, CLIENT_PORT, peer=(HOST, SERVER_PORT))
+    if name == 'unix':
+        server_path, client_path = _socket_paths()
+        if server:
+            return UnixDatagramTransport(server_path)
+        return UnixDatagramTransport(client_path, peer=server_path)
+    if name == 'tcp':
+        return TcpTransport(HOST, SERVER_PORT, server=server)
+    if name == 'shm':
+        return SharedMemoryTransport('benchmark', server=server)
+    raise ValueError(f"Unknown transport: {name}")
+
+
+def command_message():
+    """Binary joint position command of a 7-joint robot."""
+    return protocol.encode_command('joint_position', [0.0] * 7, protocol.CODEC_BINARY)
+
+
+def state_message():
+    """Binary robot state message of a 7-joint robot."""
+    robot_states = {
+        'joint_positions': np.zeros(7),
+        'joint_velocities': np.zeros(7),
+        'joint_efforts': np.zeros(7),
+        'ee_position': np.zeros(3),
+        'ee_orientation': np.array([0.0, 0.0, 0.0, 1.0]),
+    }
+    return protocol.encode_states(robot_states, codec=protocol.CODEC_BINARY)
+
+
+def echo(name, ready, rounds):
+    """Client side: reply to every command with a robot state."""
+    transport = open_transport(name, server=False)
+    buffer = bytearray(protocol.MAX_DATAGRAM_SIZE)
+    reply = state_message()
+    # Lets the server learn the client address (and accept the TCP connection)
+    transport.send(b'hello')
+    ready.set()
+    for _ in range(rounds):
+        transport.recv(buffer)
+        transport.send(reply)
+    transport.close()
+
+
+def run(name, rounds=ROUND_TRIPS, warmup=WARMUP):
+    """Measure round trips over one transport.
+
+    Returns:
+        np.ndarray: Round-trip times in seconds, warmup excluded
+    """
+    transport = open_transport(name, server=True)
+    ready = multiprocessing.Event()
+    peer = multiprocessing.Process(target=echo, args=(name, ready, rounds + warmup))
+    peer.start()
+    buffer = bytearray(protocol.MAX_DATAGRAM_SIZE)
+    try:
+        ready.wait()
+        _, client_address = transport.recv(buffer)
+        command = command_message()
+        times = np.empty(rounds + warmup)
+        for i in range(rounds + warmup):
+            start = time.perf_counter()
+            transport.send(command, client_address)
+            transport.recv(buffer)
+            times[i] = time.perf_counter() - start
+    finally:
+        peer.join()
+        transport.close()
+    return times[warmup:]
+
+
+def main():
+    """Print round-trip latency statistics of each transport in TRANSPORTS."""
+    print(f"{ROUND_TRIPS} round trips, command {len(command_message())} B, "
+          f"state {len(state_message())} B")
+    print(f"{'transport':>10} {'mean':>9} {'p50':>9} {'p99':>9} {'max':>9}  (us)")
+    for name in TRANSPORTS:
+        times = run(name) * 1e6
+        print(f"{name:>10} {times.mean():9.1f} {np.percentile(times, 50):9.1f} "
+              f"{np.percentile(times, 99):9.1f} {times.max():9.1f}")
+
+
+if __name__ == "__main__":
+    main()
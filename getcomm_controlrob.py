@@ -1,7 +1,15 @@
 """UDP Client - Receives commands and controls Franka robot."""
-import socket
 import json
+import threading
+import time
 import numpy as np
+from scipy.spatial.transform import Rotation
+
+import protocol
+from interpolation import Interpolator, PoseInterpolator
+from playback import PlayoutClock, TrajectoryBuffer
+from shm_transport import SharedMemoryTransport
+from transport import TcpTransport, UdpTransport, UnixDatagramTransport
 
 from crisp_py.robot import Robot
 from crisp_py.robot_config import FrankaConfig
@@ -10,15 +18,58 @@ from crisp_py.robot_config import FrankaConfig
 SERVER_HOST = '192.168.2.53'  # Server computer IP address
 SERVER_PORT = 5000
 CLIENT_PORT = 5001
+ROBOT_ID = None  # Name of this robot on a multi-robot server (e.g. 'left'), optional
+# 'udp', 'tcp' (reliable, ordered), or for a server on the same host 'unix'
+# (Unix datagram sockets) or 'shm'; the server must use the same transport (and
+# be started first for 'tcp' and 'shm')
+TRANSPORT = 'udp'
+SHM_NAME = 'robot'  # Shared memory link name of the server, used with TRANSPORT = 'shm'
+SERVER_PATH = '/tmp/robot_server.sock'  # Server socket path, used with TRANSPORT = 'unix'
+CLIENT_PATH = '/tmp/robot_client.sock'  # Socket path this client binds, used with TRANSPORT = 'unix'
 VERBOSE = True
+MAX_COMMAND_RATE = 1000.0  # Highest command rate (Hz) advertised in the handshake
+# Rate (Hz) of the state publisher thread, e.g. 100-1000; None sends states only
+# after each executed command
+STATE_PUBLISH_RATE = 100.0
+HOLD_SPIN_THRESHOLD = 0.002  # Held commands due within this many seconds are waited for with sleep
+# How commands without an execute-at time are applied:
+#   'in_order'      - every command, in arrival order
+#   'latest'        - drain the transport each cycle and apply only the newest command
+#   'jitter_buffer' - hold each command for PLAYOUT_DELAY to smooth out network jitter
+COMMAND_HANDLING = 'in_order'
+PLAYOUT_DELAY = 0.05  # Jitter buffer playout delay in seconds
+# Interpolation between waypoints: 'none' (send each waypoint as is), 'linear',
+# 'cubic' or 'minimum_jerk'; Cartesian orientations are always SLERPed
+INTERPOLATION = 'minimum_jerk'
+CONTROL_RATE = 100.0  # Rate (Hz) at which interpolated targets are sent to the robot
+INTERPOLATION_DURATION = None  # Seconds per segment; None uses the interval between waypoints
+DEFAULT_SEGMENT_DURATION = 2.0  # Segment duration for the first waypoint
+MAX_SEGMENT_DURATION = 5.0  # Upper bound on the measured interval between waypoints
+
+if TRANSPORT == 'shm':
+    # Same message semantics as UDP, through the server's shared memory rings
+    transport = SharedMemoryTransport(SHM_NAME)
+    print(f"Client attached to shared memory link '{SHM_NAME}'")
+elif TRANSPORT == 'tcp':
+    transport = TcpTransport(SERVER_HOST, SERVER_PORT)
+    print(f"Client connected to {SERVER_HOST}:{SERVER_PORT} over TCP")
+elif TRANSPORT == 'unix':
+    # Same datagram semantics as UDP, without the IP stack
+    transport = UnixDatagramTransport(CLIENT_PATH, peer=SERVER_PATH)
+    print(f"Client started on Unix socket {CLIENT_PATH}")
+elif TRANSPORT == 'udp':
+    transport = UdpTransport('0.0.0.0', CLIENT_PORT, peer=(SERVER_HOST, SERVER_PORT))
+    print(f"Client started on port {CLIENT_PORT}")
+else:
+    raise ValueError(f"Unknown transport: {TRANSPORT}")
 
-# Initialize UDP socket
-sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-sock.bind(('0.0.0.0', CLIENT_PORT))
-print(f"Client started on port {CLIENT_PORT}")
+# Messages are received into one reused buffer; decoded binary command values
+# are views into it, so anything kept past the next receive is copied
+recv_buffer = bytearray(protocol.MAX_DATAGRAM_SIZE)
+recv_view = memoryview(recv_buffer)
 
 # Initialize robot (following crisp_py example)
-robot_config = FrankaConfig(publish_frequency=100.0, target_joint_topic="target_joint")
+robot_config = FrankaConfig(publish_frequency=CONTROL_RATE, target_joint_topic="target_joint")
 robot = Robot(namespace="")
 robot.wait_until_ready()
 print("Robot ready")
@@ -26,28 +77,87 @@ print("Robot ready")
 # Global variable to store current control mode
 control_mode = None
 
+# Session settings agreed in the handshake (defaults apply to legacy servers)
+session = {
+    'protocol_version': protocol.LEGACY_VERSION,
+    'codec': protocol.CODEC_JSON,
+    'state_fields': list(protocol.STATE_FIELDS),
+    'max_datagram_size': protocol.LEGACY_MAX_DATAGRAM_SIZE,
+    'command_rate': None,
+    'state_rate': None,
+}
+
+# Sequence numbering of sent states and accounting of received commands
+state_seq = 0
+state_buffer = None  # Preallocated binary states message (protocol.StateBuffer)
+command_tracker = protocol.SequenceTracker()
+last_command_seq = None
+last_command_t = None
+
+# Timed commands and trajectory chunk waypoints held until their execute-at time
+playback_buffer = TrajectoryBuffer()
+late_commands = 0
+
+# Commands superseded by a newer one while draining the transport ('latest' mode)
+dropped_commands = 0
+playout_clock = PlayoutClock(PLAYOUT_DELAY)
+
+# Interpolation state: the interpolator of the current segment, the previous
+# waypoint (start of the next segment) and its time, and the control tick schedule
+joint_interpolator = Interpolator(INTERPOLATION)
+pose_interpolator = PoseInterpolator(INTERPOLATION)
+active_interpolator = None
+last_joint_waypoint = None
+last_pose_waypoint = None  # (position, quaternion)
+last_waypoint_time = None
+next_control_tick = None
+
+# Fixed-rate state publisher thread
+state_publisher = None
+state_publisher_stop = threading.Event()
+state_publisher_missed = 0
+
+# Offset of the server's sync clock from ours (server - client, seconds); zero
+# until the server's clock pings provide an estimate
+clock_offset = 0.0
+
 
 def send_handshake():
-    """Send initial handshake to server."""
-    message = json.dumps({'status': 'ready'})
-    sock.sendto(message.encode(), (SERVER_HOST, SERVER_PORT))
+    """Send initial handshake advertising client capabilities to server."""
+    message = json.dumps(protocol.make_hello(max_command_rate=MAX_COMMAND_RATE, robot_id=ROBOT_ID,
+                                             state_rate=STATE_PUBLISH_RATE))
+    transport.send(message.encode())
     print(f"Sent handshake to {SERVER_HOST}:{SERVER_PORT}")
 
 
 def receive_control_mode():
     """Receive control mode from server during handshake."""
-    global control_mode
-    data, addr = sock.recvfrom(1024)
-    message = json.loads(data.decode())
+    nbytes, addr = transport.recv(recv_buffer)
+    message = json.loads(bytes(recv_view[:nbytes]))
     
     if message.get('type') == 'handshake':
-        control_mode = message['control_mode']
-        print(f"Received control mode: {control_mode}")
+        apply_handshake(message)
         return control_mode
     else:
         raise ValueError("Expected handshake message from server")
 
 
+def apply_handshake(message):
+    """Apply the control mode and session settings of a handshake response.
+    
+    The server numbers the commands of each session from scratch, so the
+    command sequence tracking starts over as well.
+    """
+    global control_mode
+    control_mode = message['control_mode']
+    print(f"Received control mode: {control_mode}")
+    
+    # Older servers only send the control mode and keep the defaults
+    session.update({key: message[key] for key in session if key in message})
+    print(f"Session settings: {session}")
+    command_tracker.reset()
+
+
 def configure_robot_for_control_mode(mode):
     """Configure robot controller based on control mode."""
     if mode == 'joint_position':
@@ -87,95 +197,497 @@ def configure_robot_for_control_mode(mode):
         raise ValueError(f"Unknown control mode: {mode}")
 
 
-def receive_command():
-    """Receive command from server."""
-    data, addr = sock.recvfrom(1024)
-    message = json.loads(data.decode())
+def receive_command(timeout=None):
+    """Receive command from server (JSON or binary encoded).
+    
+    Args:
+        timeout: Seconds to wait (default: wait forever)
+        
+    Returns:
+        dict: Command message, or None if timeout
+    """
+    received = transport.recv(recv_buffer, timeout)
+    if received is None:
+        return None
+    nbytes, addr = received
+    # Binary command values are np.frombuffer views into recv_buffer
+    message = protocol.decode_message(recv_view[:nbytes])
     return message
 
 
 def get_robot_states():
-    """Collect current robot states including joint states and end effector pose."""
-    # Get joint states (position, velocity, effort/torque)
-    joint_positions = robot.joint_values.tolist()
-    joint_velocities = []
-    joint_efforts = []
-    # joint_velocities = robot.joint_velocities.tolist()
-    # joint_efforts = robot.joint_efforts.tolist()
-    
-    # Get end effector pose (position and orientation)
-    ee_pose = str(robot.end_effector_pose)
-    ee_position = []
-    ee_orientation = []
-    # ee_position = ee_pose[:3, 3].tolist()  # Extract position from transformation matrix
-    # ee_orientation = ee_pose[:3, :3].tolist()  # Extract rotation matrix
+    """Collect current robot states including joint states and end effector pose.
+    
+    Values are the robot's NumPy arrays, serialized as they are. The pose is
+    sent compactly as a position and a quaternion (x, y, z, w).
+    """
+    ee_pose = robot.end_effector_pose
+    ee_position = ee_pose.position
+    ee_orientation = ee_pose.orientation.as_quat()
     
     return {
-        'joint_positions': joint_positions,
-        'joint_velocities': joint_velocities,
-        'joint_efforts': joint_efforts,
-        'ee_pose': ee_pose,
+        'joint_positions': robot.joint_values,
+        'joint_velocities': robot.joint_velocities,
+        'joint_efforts': robot.joint_efforts,
+        'ee_pose': np.concatenate((ee_position, ee_orientation)),
         'ee_position': ee_position,
         'ee_orientation': ee_orientation
     }
 
 
-def send_robot_states():
-    """Send current robot states back to server."""
-    robot_states = get_robot_states()
-    message = json.dumps({'type': 'robot_states', 'data': robot_states})
-    sock.sendto(message.encode(), (SERVER_HOST, SERVER_PORT))
+def accept_command(message):
+    """Check the sequence number of a command and remember it for acknowledgement.
     
-    if VERBOSE:
+    Returns:
+        bool: False if the command is older than the latest accepted one
+    """
+    global last_command_seq, last_command_t
+    
+    # Commands from servers without sequence numbers are always accepted
+    if message.get('seq') is None:
+        return True
+    if not command_tracker.accept(message['seq']):
+        return False
+    
+    last_command_seq = message['seq']
+    last_command_t = message.get('t')
+    return True
+
+
+def fill_state_buffer(buffer):
+    """Copy the current robot states into a preallocated state buffer in place.
+    
+    Returns:
+        dict: The buffer's field views, holding the new values
+    """
+    fields = buffer.fields
+    if 'joint_positions' in fields:
+        fields['joint_positions'][:] = robot.joint_values
+    if 'joint_velocities' in fields:
+        fields['joint_velocities'][:] = robot.joint_velocities
+    if 'joint_efforts' in fields:
+        fields['joint_efforts'][:] = robot.joint_efforts
+    
+    if 'ee_pose' in fields or 'ee_position' in fields or 'ee_orientation' in fields:
+        ee_pose = robot.end_effector_pose
+        ee_orientation = ee_pose.orientation.as_quat()
+        if 'ee_pose' in fields:
+            fields['ee_pose'][:3] = ee_pose.position
+            fields['ee_pose'][3:] = ee_orientation
+        if 'ee_position' in fields:
+            fields['ee_position'][:] = ee_pose.position
+        if 'ee_orientation' in fields:
+            fields['ee_orientation'][:] = ee_orientation
+    return fields
+
+
+def send_robot_states(verbose=VERBOSE):
+    """Send current robot states back to server.
+    
+    With the binary codec, states are written into one preallocated buffer and
+    sent from it, so the publish path does not allocate per message.
+    """
+    global state_seq, state_buffer
+    
+    state_seq += 1
+    if session['codec'] == protocol.CODEC_BINARY:
+        if state_buffer is None:
+            # Field lengths are fixed by the robot, so the layout is built once
+            state_buffer = protocol.StateBuffer(
+                {key: np.size(value) for key, value in get_robot_states().items()
+                 if key in session['state_fields']})
+        robot_states = fill_state_buffer(state_buffer)
+        message = state_buffer.pack(state_seq, ack_seq=last_command_seq, ack_t=last_command_t)
+    else:
+        robot_states = get_robot_states()
+        robot_states = {key: value for key, value in robot_states.items()
+                        if key in session['state_fields']}
+        message = protocol.encode_states(robot_states, seq=state_seq, ack_seq=last_command_seq,
+                                         ack_t=last_command_t)
+    transport.send(message)
+    
+    if verbose:
         # Print readable format
         print("\n=== Sent Robot States ===")
-        print(f"Joint Positions: {robot_states['joint_positions']}")
-        print(f"Joint Velocities: {robot_states['joint_velocities']}")
-        print(f"Joint Efforts: {robot_states['joint_efforts']}")
-        print(f"EE Position: {robot_states['ee_position']}")
+        print(f"Joint Positions: {robot_states.get('joint_positions')}")
+        print(f"Joint Velocities: {robot_states.get('joint_velocities')}")
+        print(f"Joint Efforts: {robot_states.get('joint_efforts')}")
+        print(f"EE Position: {robot_states.get('ee_position')}")
+        print(f"EE Orientation (quaternion): {robot_states.get('ee_orientation')}")
         print("========================\n")
 
 
-def execute_joint_position_command(target_joints):
-    """Execute joint position command."""
+def send_command_feedback():
+    """Send states after executing a command, unless the state publisher sends them."""
+    if STATE_PUBLISH_RATE is None:
+        send_robot_states()
+
+
+def publish_states(rate):
+    """Send robot states at a fixed rate until state_publisher_stop is set.
+    
+    States are sent on absolute deadlines, so the rate does not drift with the
+    time spent reading and sending them; ticks missed by more than a period are
+    skipped and counted rather than sent in a burst.
+    
+    Args:
+        rate: Publish rate in Hz
+    """
+    global state_publisher_missed
+    
+    period = 1.0 / rate
+    next_tick = time.monotonic()
+    while not state_publisher_stop.is_set():
+        send_robot_states(verbose=False)
+        next_tick += period
+        remaining = next_tick - time.monotonic()
+        if remaining < -period:
+            state_publisher_missed += 1
+            next_tick = time.monotonic()
+        elif remaining > 0:
+            state_publisher_stop.wait(remaining)
+
+
+def start_state_publisher(rate):
+    """Start publishing robot states at a fixed rate on a background thread."""
+    global state_publisher
+    
+    state_publisher_stop.clear()
+    state_publisher = threading.Thread(target=publish_states, args=(rate,), daemon=True)
+    state_publisher.start()
+    print(f"Publishing robot states at {rate} Hz")
+
+
+def stop_state_publisher():
+    """Stop the state publisher thread and wait for it to finish."""
+    global state_publisher
+    
+    if state_publisher is None:
+        return
+    state_publisher_stop.set()
+    state_publisher.join()
+    state_publisher = None
+    print(f"State publisher stopped ({state_seq} states sent, "
+          f"{state_publisher_missed} missed ticks)")
+
+
+def handle_clock_ping(message):
+    """Answer a clock synchronization ping and adopt the server's offset estimate."""
+    global clock_offset
+    
+    receive_time = protocol.sync_clock()
+    transport.send(protocol.encode_clock_pong(message, receive_time))
+    
+    # The server estimates client minus server clock
+    if message.get('offset') is not None:
+        clock_offset = -message['offset']
+
+
+def hold_command(message):
+    """Hold a command carrying an execute-at time until that time comes.
+    
+    Commands that arrive after their execute-at time are executed immediately.
+    """
+    global late_commands
+    
+    local_time = message['execute_at'] - clock_offset
+    if local_time <= protocol.sync_clock():
+        late_commands += 1
+        print(f"Command seq {message.get('seq')} arrived "
+              f"{protocol.sync_clock() - local_time:.4f}s after its execute-at time "
+              f"({late_commands} late so far)")
+        execute_command(message)
+        send_command_feedback()
+        return
+    playback_buffer.add(local_time, message['type'], np.array(message['data']))
+
+
+def buffer_trajectory_chunk(message):
+    """Queue the waypoints of a trajectory chunk for playback at their times."""
+    times = np.asarray(message['times']) - clock_offset
+    playback_buffer.add_chunk(times, message['mode'], np.array(message['data']))
+    if VERBOSE:
+        print(f"Buffered {len(times)} waypoints, counters: {playback_buffer.get_counters()}")
+
+
+def time_until_next_command():
+    """Seconds until the next held command or interpolation tick is due, or None if neither."""
+    deadlines = []
+    next_time = playback_buffer.next_time()
+    if next_time is not None:
+        deadlines.append(next_time - HOLD_SPIN_THRESHOLD)
+    if active_interpolator is not None and active_interpolator.active:
+        deadlines.append(next_control_tick)
+    if not deadlines:
+        return None
+    return max(min(deadlines) - protocol.sync_clock(), 0.0)
+
+
+def run_due_commands():
+    """Execute the newest held command whose execute-at time has come."""
+    next_time = playback_buffer.next_time()
+    if next_time is None:
+        return
+    remaining = next_time - protocol.sync_clock()
+    if remaining > HOLD_SPIN_THRESHOLD:
+        return
+    if remaining > 0:
+        time.sleep(remaining)
+    
+    due = playback_buffer.pop_due(protocol.sync_clock())
+    if due is not None:
+        t, command_type, command_data = due
+        execute_command({'type': command_type, 'data': command_data}, at=t)
+        send_command_feedback()
+
+
+def handle_message(message):
+    """Handle a received message.
+    
+    Clock pings are answered, stale commands dropped, and trajectory chunks,
+    timed commands and (in 'jitter_buffer' mode) all commands buffered.
+    
+    Returns:
+        dict: Command to execute now, or None
+    """
+    if message.get('type') == 'clock_ping':
+        handle_clock_ping(message)
+        return None
+    if message.get('type') == 'handshake':
+        # Renegotiated session (the server saw our hello again)
+        apply_handshake(message)
+        return None
+    if not accept_command(message):
+        print(f"Dropped stale command (seq {message.get('seq')}), "
+              f"counters: {command_tracker.get_counters()}")
+        return None
+    
+    # Trajectory chunks and commands with an execute-at time wait for it
+    if message.get('type') == 'trajectory_chunk':
+        buffer_trajectory_chunk(message)
+        return None
+    if message.get('execute_at') is not None:
+        hold_command(message)
+        return None
+    
+    if COMMAND_HANDLING == 'jitter_buffer':
+        arrival = protocol.sync_clock()
+        sent = message.get('t', arrival)
+        playback_buffer.add(playout_clock.playout_time(sent, arrival),
+                            message['type'], np.array(message['data']))
+        return None
+    return message
+
+
+def receive_latest_command(timeout=None):
+    """Wait for a message, then drain the transport and keep only the newest command.
+    
+    Every message is handled, so clock pings and buffered commands are never
+    lost; only immediate commands superseded by a newer one are dropped.
+    
+    Args:
+        timeout: Seconds to wait for the first message (default: wait forever)
+        
+    Returns:
+        dict: Newest command to execute now, or None
+    """
+    global dropped_commands
+    
+    latest = None
+    message = receive_command(timeout)
+    while message is not None:
+        command = handle_message(message)
+        if command is not None:
+            if latest is not None:
+                dropped_commands += 1
+                if VERBOSE:
+                    print(f"Dropped command seq {latest.get('seq')} superseded by "
+                          f"seq {command.get('seq')} ({dropped_commands} dropped so far)")
+            # Keep the values past the next receive into recv_buffer
+            latest = dict(command, data=np.array(command['data']))
+        message = receive_command(timeout=0)
+    return latest
+
+
+def get_command_counters():
+    """Get counters of received, lost, dropped and late commands.
+    
+    Returns:
+        dict: Sequence accounting, commands dropped while draining, late timed
+            commands, jitter buffer and playback buffer counters
+    """
+    return {
+        **command_tracker.get_counters(),
+        'dropped': dropped_commands,
+        'late': late_commands,
+        'playout': playout_clock.get_counters(),
+        'playback': playback_buffer.get_counters(),
+    }
+
+
+def execute_command(message, at=None):
+    """Execute a command message based on its type.
+    
+    Args:
+        message: Command message
+        at: Local time the command is scheduled for (default: now)
+    """
+    command_type = message.get('type')
+    command_data = message.get('data')
+    
+    # Execute command based on type
+    if command_type == 'joint_position':
+        execute_joint_position_command(command_data, at)
+        
+    elif command_type == 'ee_position':
+        execute_ee_position_command(command_data, at)
+        
+    elif command_type == 'joint_velocity':
+        print("Joint velocity control not implemented yet")
+        
+    elif command_type == 'ee_velocity':
+        print("EE velocity control not implemented yet")
+        
+    elif command_type == 'joint_torque':
+        print("Joint torque control not implemented yet")
+        
+    elif command_type == 'ee_force':
+        print("EE force control not implemented yet")
+        
+    else:
+        print(f"Unknown command type: {command_type}")
+
+
+def segment_duration(t):
+    """Duration of the interpolation segment towards a waypoint due at time t.
+    
+    The interval since the previous waypoint's time, so that each segment
+    ends when the next waypoint is due.
+    """
+    global last_waypoint_time
+    
+    if INTERPOLATION_DURATION is not None:
+        duration = INTERPOLATION_DURATION
+    elif last_waypoint_time is None:
+        duration = DEFAULT_SEGMENT_DURATION
+    else:
+        duration = min(max(t - last_waypoint_time, 0.0), MAX_SEGMENT_DURATION)
+    last_waypoint_time = t
+    return duration
+
+
+def start_interpolation(interpolator):
+    """Make interpolator the active one; its targets go out on the next control tick."""
+    global active_interpolator, next_control_tick
+    
+    active_interpolator = interpolator
+    if next_control_tick is None:
+        next_control_tick = protocol.sync_clock()
+
+
+def run_interpolation():
+    """Send the next interpolated target to the robot if a control tick is due.
+    
+    Control ticks are CONTROL_RATE apart on a fixed schedule, however often
+    waypoints arrive.
+    """
+    global next_control_tick
+    
+    if active_interpolator is None or not active_interpolator.active:
+        return
+    now = protocol.sync_clock()
+    if now < next_control_tick:
+        return
+    # Ticks lost to a slow loop (or while idle) are skipped rather than sent in a burst
+    period = 1.0 / CONTROL_RATE
+    next_control_tick += (int((now - next_control_tick) / period) + 1) * period
+    
+    if active_interpolator is joint_interpolator:
+        robot.set_target_joint(joint_interpolator.sample(now))
+    else:
+        position, quaternion = pose_interpolator.sample(now)
+        target_pose = robot.end_effector_pose.copy()
+        target_pose.position = position
+        target_pose.orientation = Rotation.from_quat(quaternion)
+        robot.set_target(pose=target_pose)
+
+
+def execute_joint_position_command(target_joints, at=None):
+    """Execute joint position command.
+    
+    Unless INTERPOLATION is 'none', the robot is moved from the previous
+    waypoint to target_joints by interpolated targets sent at CONTROL_RATE,
+    over a segment starting at the waypoint's time.
+    
+    Args:
+        target_joints: Joint positions
+        at: Local time the waypoint is due (default: now)
+    """
+    global last_joint_waypoint
+    
     print(f"Executing joint position command: {target_joints}")
-    robot.set_target_joint(np.array(target_joints))
+    if INTERPOLATION == 'none':
+        robot.set_target_joint(np.array(target_joints))
+        return
+    
+    t = protocol.sync_clock() if at is None else at
+    start = robot.joint_values if last_joint_waypoint is None else last_joint_waypoint
+    joint_interpolator.set_target(start, target_joints, t, segment_duration(t))
+    last_joint_waypoint = np.array(target_joints, dtype=float)
+    start_interpolation(joint_interpolator)
 
 
-def execute_ee_position_command(target_ee_pos):
+def execute_ee_position_command(target_ee_pos, at=None):
     """Execute end effector position command.
     
+    Unless INTERPOLATION is 'none', the position is interpolated and the
+    orientation SLERPed from the previous waypoint at CONTROL_RATE.
+    
     Args:
         target_ee_pos: List of 3 values [x, y, z] or 6 values [x, y, z, roll, pitch, yaw]
+        at: Local time the waypoint is due (default: now)
     """
+    global last_pose_waypoint
+    
     print(f"Executing EE position command: {target_ee_pos}")
     
     if len(target_ee_pos) == 3:
         # Only position provided, keep current orientation
-        current_ee_pose = robot.end_effector_pose.copy()
-        target_pose = current_ee_pose
-        target_pose.position = np.array(target_ee_pos)
+        target_position = np.array(target_ee_pos)
+        target_rotation = None
         
     elif len(target_ee_pos) == 6:
         # Position + orientation (roll, pitch, yaw) provided
         x, y, z, roll, pitch, yaw = target_ee_pos
-        
-        # Create rotation matrix from roll, pitch, yaw
-        from scipy.spatial.transform import Rotation
-        rotation = Rotation.from_euler('xyz', [roll, pitch, yaw])
-        # rotation_matrix = rotation.as_matrix()
-        
-        # Create pose with position and orientation
-        current_ee_pose = robot.end_effector_pose.copy()
-        target_pose = current_ee_pose
-        target_pose.position = np.array([x, y, z])
-        target_pose.orientation = rotation
+        target_position = np.array([x, y, z])
+        target_rotation = Rotation.from_euler('xyz', [roll, pitch, yaw])
     else:
         raise ValueError(f"EE position command must have 3 or 6 values, got {len(target_ee_pos)}")
     
-    # Use Cartesian controller to set target pose directly
-    # This uses the cartesian_impedance_controller to move to the target
-    robot.set_target(pose=target_pose)
+    if INTERPOLATION == 'none':
+        # Use Cartesian controller to set target pose directly
+        # This uses the cartesian_impedance_controller to move to the target
+        target_pose = robot.end_effector_pose.copy()
+        target_pose.position = target_position
+        if target_rotation is not None:
+            target_pose.orientation = target_rotation
+        robot.set_target(pose=target_pose)
+        return
+    
+    if last_pose_waypoint is None:
+        current_ee_pose = robot.end_effector_pose
+        start_position = current_ee_pose.position
+        start_quat = current_ee_pose.orientation.as_quat()
+    else:
+        start_position, start_quat = last_pose_waypoint
+    target_quat = start_quat if target_rotation is None else target_rotation.as_quat()
+    
+    t = protocol.sync_clock() if at is None else at
+    pose_interpolator.set_target(start_position, target_position, t, segment_duration(t),
+                                 start_quat, target_quat)
+    last_pose_waypoint = (np.array(target_position, dtype=float),
+                          np.array(target_quat, dtype=float))
+    start_interpolation(pose_interpolator)
 
 
 # Main loop
@@ -192,44 +704,38 @@ def main():
         # Configure robot based on control mode
         configure_robot_for_control_mode(control_mode)
         
+        # Publish states at a fixed rate, independently of commands
+        if STATE_PUBLISH_RATE is not None:
+            start_state_publisher(STATE_PUBLISH_RATE)
+        
         # Main command loop
         print(f"Waiting for {control_mode} commands from server...")
         while True:
-            # Receive command
-            message = receive_command()
-            command_type = message.get('type')
-            command_data = message.get('data')
-            
-            # Execute command based on type
-            if command_type == 'joint_position':
-                execute_joint_position_command(command_data)
-                
-            elif command_type == 'ee_position':
-                execute_ee_position_command(command_data)
-                
-            elif command_type == 'joint_velocity':
-                print("Joint velocity control not implemented yet")
-                
-            elif command_type == 'ee_velocity':
-                print("EE velocity control not implemented yet")
-                
-            elif command_type == 'joint_torque':
-                print("Joint torque control not implemented yet")
-                
-            elif command_type == 'ee_force':
-                print("EE force control not implemented yet")
-                
+            # Execute held commands that are due and send the interpolated
+            # target, then wait for the next command until one of those is due
+            run_due_commands()
+            run_interpolation()
+            timeout = time_until_next_command()
+            if COMMAND_HANDLING == 'latest':
+                command = receive_latest_command(timeout)
             else:
-                print(f"Unknown command type: {command_type}")
+                message = receive_command(timeout)
+                command = None if message is None else handle_message(message)
+            if command is None:
+                continue
+            
+            execute_command(command)
             
             # Send current robot states back to server
-            send_robot_states()
+            send_command_feedback()
             
     except KeyboardInterrupt:
         print("\nClient shutting down...")
     finally:
+        stop_state_publisher()
+        print(f"Command counters: {get_command_counters()}")
         robot.shutdown()
-        sock.close()
+        transport.close()
         print("Robot shutdown complete")
 
 
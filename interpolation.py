@@ -0,0 +1,156 @@
+"""Interpolation of sparse waypoints into dense targets for getcomm_controlrob.py.
+
+Joint-space targets are interpolated per joint; Cartesian targets interpolate
+the position the same way and the orientation by spherical linear
+interpolation (SLERP) of unit quaternions in (x, y, z, w) order, as used by
+scipy.spatial.transform.Rotation.
+"""
+import numpy as np
+
+INTERPOLATION_METHODS = ('none', 'linear', 'cubic', 'minimum_jerk')
+
+
+def progress(method, s):
+    """Fraction of a segment covered at normalized time s.
+
+    Args:
+        method: 'linear', 'cubic' (zero velocity at both ends) or 'minimum_jerk'
+            (zero velocity and acceleration at both ends); 'none' jumps to the end
+        s: Normalized time in [0, 1]
+
+    Returns:
+        float: Fraction of the way from start to target, in [0, 1]
+    """
+    if method == 'none':
+        return 1.0
+    if method == 'linear':
+        return s
+    if method == 'cubic':
+        return s * s * (3.0 - 2.0 * s)
+    if method == 'minimum_jerk':
+        return s * s * s * (10.0 + s * (-15.0 + 6.0 * s))
+    raise ValueError(f"Unknown interpolation method: {method}")
+
+
+def slerp(q0, q1, fraction):
+    """Spherical linear interpolation between two unit quaternions.
+
+    Args:
+        q0: Start quaternion (x, y, z, w)
+        q1: Target quaternion (x, y, z, w)
+        fraction: Fraction of the way from q0 to q1
+
+    Returns:
+        np.ndarray: Interpolated unit quaternion (x, y, z, w)
+    """
+    q0 = np.asarray(q0, dtype=float)
+    q1 = np.asarray(q1, dtype=float)
+    dot = np.dot(q0, q1)
+    # q and -q are the same rotation; take the shorter arc
+    if dot < 0.0:
+        q1 = -q1
+        dot = -dot
+    if dot > 0.9995:
+        # Nearly identical orientations: normalized lerp avoids dividing by ~0
+        q = q0 + fraction * (q1 - q0)
+        return q / np.linalg.norm(q)
+    theta = np.arccos(dot)
+    sin_theta = np.sin(theta)
+    return (np.sin((1.0 - fraction) * theta) * q0 + np.sin(fraction * theta) * q1) / sin_theta
+
+
+class Interpolator:
+    """Interpolates from the current target to a new waypoint over one segment."""
+
+    def __init__(self, method='minimum_jerk'):
+        """Initialize the interpolator.
+
+        Args:
+            method: One of INTERPOLATION_METHODS (default: 'minimum_jerk')
+        """
+        if method not in INTERPOLATION_METHODS:
+            raise ValueError(f"Unknown interpolation method: {method}, "
+                             f"expected one of {INTERPOLATION_METHODS}")
+        self.method = method
+        self.active = False
+        self._t_start = 0.0
+        self._duration = 0.0
+        self._start = None
+        self._target = None
+
+    def set_target(self, start, target, t_start, duration):
+        """Start a new segment.
+
+        Args:
+            start: Values at the start of the segment (normally the last target sent)
+            target: Waypoint values to reach at the end of the segment
+            t_start: Start time of the segment
+            duration: Segment duration in seconds
+        """
+        # Copies: the values may be views into a reused receive buffer
+        self._start = np.array(start, dtype=float)
+        self._target = np.array(target, dtype=float)
+        self._t_start = t_start
+        self._duration = duration
+        self.active = True
+
+    def _fraction(self, now):
+        """Fraction of the segment covered at time now; ends the segment when reached."""
+        if self._duration <= 0.0:
+            s = 1.0
+        else:
+            s = min(max((now - self._t_start) / self._duration, 0.0), 1.0)
+        if s >= 1.0:
+            self.active = False
+            return 1.0
+        return progress(self.method, s)
+
+    def sample(self, now):
+        """Interpolated values at time now.
+
+        Args:
+            now: Current time, on the same clock as t_start
+
+        Returns:
+            np.ndarray: Values to send to the robot
+        """
+        fraction = self._fraction(now)
+        return self._start + fraction * (self._target - self._start)
+
+
+class PoseInterpolator(Interpolator):
+    """Interpolates Cartesian poses: position per axis, orientation by SLERP."""
+
+    def __init__(self, method='minimum_jerk'):
+        super().__init__(method)
+        self._start_quat = None
+        self._target_quat = None
+
+    def set_target(self, start, target, t_start, duration, start_quat=None, target_quat=None):
+        """Start a new segment.
+
+        Args:
+            start: Position [x, y, z] at the start of the segment
+            target: Position [x, y, z] to reach at the end of the segment
+            t_start: Start time of the segment
+            duration: Segment duration in seconds
+            start_quat: Orientation (x, y, z, w) at the start of the segment
+            target_quat: Orientation (x, y, z, w) to reach (default: keep start_quat)
+        """
+        super().set_target(start, target, t_start, duration)
+        self._start_quat = None if start_quat is None else np.array(start_quat, dtype=float)
+        self._target_quat = self._start_quat if target_quat is None else np.array(target_quat,
+                                                                                   dtype=float)
+
+    def sample(self, now):
+        """Interpolated pose at time now.
+
+        Returns:
+            tuple: (position, quaternion) as np.ndarray; quaternion is None if no
+                orientation was given
+        """
+        fraction = self._fraction(now)
+        position = self._start + fraction * (self._target - self._start)
+        if self._start_quat is None:
+            return position, None
+        return position, slerp(self._start_quat, self._target_quat, fraction)
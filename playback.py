@@ -0,0 +1,149 @@
+"""Client-side buffering of timed commands for getcomm_controlrob.py.
+
+Kept separate from the client script so it can be used without a robot.
+"""
+import heapq
+
+
+class TrajectoryBuffer:
+    """Time-ordered buffer of waypoints that are applied at their scheduled times.
+
+    Waypoints come from timed commands and trajectory chunks. When several
+    waypoints are due at once (the client fell behind), only the newest one is
+    applied and the older ones are counted as skipped.
+    """
+
+    def __init__(self, capacity=100000):
+        """Initialize the buffer.
+
+        Args:
+            capacity: Maximum number of buffered waypoints; further waypoints are
+                dropped and counted as overflow (default: 100000)
+        """
+        self.capacity = capacity
+        self._heap = []
+        self._counter = 0
+        self.added = 0
+        self.played = 0
+        self.skipped = 0
+        self.overflow = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def add(self, t, control_mode, values):
+        """Add a waypoint.
+
+        Args:
+            t: Local time at which to apply the waypoint
+            control_mode: Type of command ('joint_position', 'ee_position', etc.)
+            values: Command values
+        """
+        if len(self._heap) >= self.capacity:
+            self.overflow += 1
+            return
+        # The counter keeps equal times in arrival order
+        heapq.heappush(self._heap, (t, self._counter, control_mode, values))
+        self._counter += 1
+        self.added += 1
+
+    def add_chunk(self, times, control_mode, waypoints):
+        """Add several waypoints of the same control mode.
+
+        Args:
+            times: Local time of each waypoint
+            control_mode: Type of command ('joint_position', 'ee_position', etc.)
+            waypoints: Sequence of command value lists
+        """
+        for t, values in zip(times, waypoints):
+            self.add(t, control_mode, values)
+
+    def next_time(self):
+        """Local time of the next buffered waypoint, or None if empty."""
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        """Remove all waypoints due at or before now and return the newest.
+
+        Args:
+            now: Current local time
+
+        Returns:
+            tuple: (time, control_mode, values) of the newest due waypoint, or None
+        """
+        due = None
+        while self._heap and self._heap[0][0] <= now:
+            if due is not None:
+                self.skipped += 1
+            due = heapq.heappop(self._heap)
+        if due is None:
+            return None
+        self.played += 1
+        return due[0], due[2], due[3]
+
+    def clear(self):
+        """Drop all buffered waypoints."""
+        self._heap.clear()
+
+    def get_counters(self):
+        """Get buffer counters.
+
+        Returns:
+            dict: Waypoints added, played, skipped (stale when applied), dropped
+                on overflow and currently buffered
+        """
+        return {
+            'added': self.added,
+            'played': self.played,
+            'skipped': self.skipped,
+            'overflow': self.overflow,
+            'buffered': len(self._heap),
+        }
+
+
+class PlayoutClock:
+    """Playout times for commands sent without an execute-at time (jitter buffer).
+
+    Each command is played out a fixed delay after the fastest observed transit:
+    playout = sent + min(arrival - sent) + delay. The sender and receiver clocks
+    need not be synchronized, since only the difference in transit time between
+    commands matters. Commands whose transit exceeds the fastest one by more
+    than the delay arrive after their playout time and are counted as late.
+    """
+
+    def __init__(self, delay=0.05):
+        """Initialize the playout clock.
+
+        Args:
+            delay: Playout delay in seconds; absorbs up to this much jitter (default: 0.05)
+        """
+        self.delay = delay
+        self.min_transit = None
+        self.late = 0
+
+    def playout_time(self, sent, arrival):
+        """Compute when to apply a command.
+
+        Args:
+            sent: Send timestamp of the command (sender clock)
+            arrival: Local arrival time
+
+        Returns:
+            float: Local playout time (the arrival time for late commands)
+        """
+        transit = arrival - sent
+        if self.min_transit is None or transit < self.min_transit:
+            self.min_transit = transit
+        playout = sent + self.min_transit + self.delay
+        if playout < arrival:
+            self.late += 1
+            return arrival
+        return playout
+
+    def get_counters(self):
+        """Get playout counters.
+
+        Returns:
+            dict: Commands that arrived after their playout time and the delay used
+        """
+        return {'late': self.late, 'delay': self.delay}
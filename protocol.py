@@ -0,0 +1,775 @@
+"""Wire protocol shared by sendcomm.py (server) and getcomm_controlrob.py (client).
+
+Two codecs are supported:
+- json: human readable {'type': ..., 'data': ...} messages (useful for debugging)
+- binary: fixed header followed by packed little-endian float64 values
+
+Binary messages start with MAGIC, which can never be the first byte of a JSON
+message, so receivers can decode either codec without knowing which one was used.
+
+Robot states are sent as JSON or, with the binary codec, as packed float64
+arrays written straight from the client's NumPy arrays and decoded into
+NumPy arrays with np.frombuffer.
+
+Every message carries a sequence number ('seq') and the sender's time.monotonic()
+at send time ('t'). Receivers use SequenceTracker to drop stale packets and count
+losses, reorders and duplicates.
+
+Dense trajectories are sent as trajectory_chunk messages carrying several
+waypoints with their execute-at times, sized to fit the network MTU.
+
+Clocks are synchronized with NTP-style clock_ping/clock_pong exchanges over the
+same socket (see ClockSync), so no external NTP/PTP service is required.
+
+The handshake negotiates protocol version, codec, command rate, state fields and
+maximum datagram size (see make_hello and negotiate). Peers that send a bare
+{'status': 'ready'} are treated as legacy version 1 clients and get JSON.
+"""
+import json
+import struct
+import time
+from collections import deque
+
+import numpy as np
+
+CODEC_JSON = 'json'
+CODEC_BINARY = 'binary'
+# Supported codecs, fastest first
+CODECS = (CODEC_BINARY, CODEC_JSON)
+
+# Binary header: magic, protocol version, message type id, sequence number,
+# send timestamp, number of float64 values
+MAGIC = 0xF5
+VERSION = 2
+HEADER = struct.Struct('<BBBIdH')
+SEQ_MASK = 0xFFFFFFFF
+
+# Protocol version assumed for peers that do not advertise one
+LEGACY_VERSION = 1
+
+# Largest datagram a peer accepts (bytes); legacy clients used a 1024 byte buffer
+MAX_DATAGRAM_SIZE = 4096
+LEGACY_MAX_DATAGRAM_SIZE = 1024
+
+# Robot state fields a client can report
+STATE_FIELDS = (
+    'joint_positions',
+    'joint_velocities',
+    'joint_efforts',
+    'ee_pose',
+    'ee_position',
+    'ee_orientation',
+)
+# Fields a server requests by default: ee_pose only repeats ee_position and
+# ee_orientation, so the server derives it (see add_ee_pose) instead
+DEFAULT_STATE_FIELDS = tuple(field for field in STATE_FIELDS if field != 'ee_pose')
+
+# Binary type id of robot states messages. The header count is the total number
+# of float64 values; STATE_HEAD follows with the acknowledged command (ack_t is
+# NaN if none) and a bitmask of the STATE_FIELDS present, then one uint8 length
+# per present field and the field values in STATE_FIELDS order
+STATES_TYPE = 0x10
+STATE_HEAD = struct.Struct('<IdB')
+
+# Command message types and their binary type ids
+COMMAND_TYPES = {
+    'joint_position': 1,
+    'ee_position': 2,
+    'joint_velocity': 3,
+    'ee_velocity': 4,
+    'joint_torque': 5,
+    'ee_force': 6,
+}
+TYPE_NAMES = {type_id: name for name, type_id in COMMAND_TYPES.items()}
+
+# Type id flag of binary commands carrying an execute-at time: a float64 between
+# the header and the command values
+TIMED_FLAG = 0x80
+EXECUTE_AT = struct.Struct('<d')
+
+# Type id flag of binary trajectory chunks: the header count is the number of
+# waypoints N, followed by the waypoint dimension D and N rows of
+# [execute-at time, value_1, ..., value_D]
+CHUNK_FLAG = 0x40
+CHUNK_DIM = struct.Struct('<H')
+
+# Largest UDP payload that fits a standard 1500 byte Ethernet MTU without fragmentation
+MTU_PAYLOAD = 1472
+
+
+# sync_clock() = wall-clock time at startup + monotonic time elapsed since, so it
+# starts out close to the wall clock but never jumps when the wall clock is adjusted
+SYNC_CLOCK_BASE = time.time() - time.monotonic()
+
+
+def sync_clock():
+    """Clock used for execute-at times and clock synchronization (seconds).
+
+    Hosts whose wall clocks are synchronized (e.g. by NTP) roughly agree on it;
+    the remaining offset and drift between server and client are estimated with
+    clock_ping/clock_pong exchanges (see ClockSync).
+    """
+    return time.monotonic() + SYNC_CLOCK_BASE
+
+# Cache of payload structs keyed by number of float64 values
+_payload_structs = {}
+
+
+def _payload_struct(count):
+    """Get (cached) struct for packing count float64 values."""
+    payload = _payload_structs.get(count)
+    if payload is None:
+        payload = struct.Struct(f'<{count}d')
+        _payload_structs[count] = payload
+    return payload
+
+
+def encode_command(control_mode, command_values, codec=CODEC_JSON, seq=0, timestamp=None,
+                   execute_at=None):
+    """Encode a command message.
+
+    Args:
+        control_mode: Type of command ('joint_position', 'ee_position', etc.)
+        command_values: Sequence of command values
+        codec: 'json' or 'binary' (default: 'json')
+        seq: Sequence number of the message (default: 0)
+        timestamp: Send time from time.monotonic() (default: now)
+        execute_at: sync_clock() time at which the client should apply the
+            command (default: apply on receipt)
+
+    Returns:
+        bytes: Encoded message ready to send
+    """
+    if control_mode not in COMMAND_TYPES:
+        raise ValueError(f"Unknown control mode: {control_mode}")
+    if timestamp is None:
+        timestamp = time.monotonic()
+    seq &= SEQ_MASK
+
+    if codec == CODEC_BINARY:
+        count = len(command_values)
+        type_id = COMMAND_TYPES[control_mode]
+        if execute_at is None:
+            return (HEADER.pack(MAGIC, VERSION, type_id, seq, timestamp, count)
+                    + _payload_struct(count).pack(*command_values))
+        return (HEADER.pack(MAGIC, VERSION, type_id | TIMED_FLAG, seq, timestamp, count)
+                + EXECUTE_AT.pack(execute_at) + _payload_struct(count).pack(*command_values))
+    elif codec == CODEC_JSON:
+        message = {'type': control_mode, 'seq': seq, 't': timestamp, 'data': list(command_values)}
+        if execute_at is not None:
+            message['execute_at'] = execute_at
+        return json.dumps(message).encode()
+    else:
+        raise ValueError(f"Unknown codec: {codec}")
+
+
+# Upper bound on the JSON size of one float: repr() is at most 24 characters, plus ", "
+JSON_FLOAT_SIZE = 26
+# Upper bound on the JSON size of a trajectory chunk without its waypoints
+JSON_CHUNK_OVERHEAD = 128
+
+
+def max_chunk_waypoints(dim, max_datagram_size=MTU_PAYLOAD, codec=CODEC_BINARY):
+    """Number of waypoints of a given dimension that fit in one trajectory chunk.
+
+    Args:
+        dim: Number of values per waypoint
+        max_datagram_size: Datagram size limit in bytes (default: MTU_PAYLOAD)
+        codec: 'binary' (exact) or 'json' (worst case estimate) (default: 'binary')
+
+    Returns:
+        int: Waypoints per chunk (at least 1)
+    """
+    if codec == CODEC_JSON:
+        row_size = JSON_FLOAT_SIZE * (dim + 1) + 4
+        return max(1, (max_datagram_size - JSON_CHUNK_OVERHEAD) // row_size)
+    row_size = 8 * (dim + 1)
+    return max(1, (max_datagram_size - HEADER.size - CHUNK_DIM.size) // row_size)
+
+
+def encode_trajectory_chunk(control_mode, times, waypoints, codec=CODEC_JSON, seq=0,
+                            timestamp=None):
+    """Encode several timestamped waypoints in one message.
+
+    Args:
+        control_mode: Type of command ('joint_position', 'ee_position', etc.)
+        times: sync_clock() execute-at time of each waypoint
+        waypoints: Sequence of command value lists, all of the same length,
+            or an (N, D) array
+        codec: 'json' or 'binary' (default: 'json')
+        seq: Sequence number of the message (default: 0)
+        timestamp: Send time from time.monotonic() (default: now)
+
+    Returns:
+        bytes: Encoded message ready to send
+    """
+    if control_mode not in COMMAND_TYPES:
+        raise ValueError(f"Unknown control mode: {control_mode}")
+    if len(times) != len(waypoints):
+        raise ValueError(f"Got {len(times)} times for {len(waypoints)} waypoints")
+    if timestamp is None:
+        timestamp = time.monotonic()
+    seq &= SEQ_MASK
+
+    if codec == CODEC_BINARY:
+        count = len(waypoints)
+        if isinstance(waypoints, np.ndarray) and waypoints.ndim == 2:
+            # Whole-array path: rows of [t, values...] written in one copy
+            rows = np.empty((count, waypoints.shape[1] + 1), dtype='<f8')
+            rows[:, 0] = times
+            rows[:, 1:] = waypoints
+            return (HEADER.pack(MAGIC, VERSION, COMMAND_TYPES[control_mode] | CHUNK_FLAG, seq,
+                                timestamp, count)
+                    + CHUNK_DIM.pack(waypoints.shape[1]) + rows.tobytes())
+        dim = len(waypoints[0]) if count else 0
+        values = []
+        for t, waypoint in zip(times, waypoints):
+            if len(waypoint) != dim:
+                raise ValueError(f"Waypoints must all have {dim} values, got {len(waypoint)}")
+            values.append(t)
+            values.extend(waypoint)
+        return (HEADER.pack(MAGIC, VERSION, COMMAND_TYPES[control_mode] | CHUNK_FLAG, seq,
+                            timestamp, count)
+                + CHUNK_DIM.pack(dim) + _payload_struct(len(values)).pack(*values))
+    elif codec == CODEC_JSON:
+        return json.dumps({'type': 'trajectory_chunk', 'mode': control_mode, 'seq': seq,
+                           't': timestamp, 'times': list(times),
+                           'data': [list(waypoint) for waypoint in waypoints]}).encode()
+    else:
+        raise ValueError(f"Unknown codec: {codec}")
+
+
+def _json_default(value):
+    """Serialize NumPy arrays and scalars in JSON messages."""
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode_states(robot_states, seq=0, timestamp=None, ack_seq=None, ack_t=None,
+                  codec=CODEC_JSON):
+    """Encode a robot states message.
+
+    Args:
+        robot_states: Robot states dictionary of numeric arrays (NumPy arrays or lists),
+            keyed by STATE_FIELDS
+        seq: Sequence number of the message (default: 0)
+        timestamp: Send time from time.monotonic() (default: now)
+        ack_seq: Sequence number of the last command received (optional)
+        ack_t: Send timestamp of the last command received, echoed back so the
+            server can compute round-trip time on its own clock (optional)
+        codec: 'json' or 'binary' (default: 'json')
+
+    Returns:
+        bytes: Encoded message ready to send
+    """
+    if timestamp is None:
+        timestamp = time.monotonic()
+    seq &= SEQ_MASK
+
+    if codec == CODEC_BINARY:
+        state_buffer = StateBuffer({field: np.size(values) for field, values in robot_states.items()})
+        for field, values in state_buffer.fields.items():
+            values[:] = np.ravel(robot_states[field])
+        return bytes(state_buffer.pack(seq, timestamp, ack_seq, ack_t))
+    if codec != CODEC_JSON:
+        raise ValueError(f"Unknown codec: {codec}")
+
+    return json.dumps({'type': 'robot_states', 'seq': seq, 't': timestamp,
+                       'ack_seq': ack_seq, 'ack_t': ack_t, 'data': robot_states},
+                      default=_json_default).encode()
+
+
+def encode_clock_ping(seq, offset=None):
+    """Encode a clock synchronization ping (server -> client, JSON).
+
+    Args:
+        seq: Sequence number of the ping
+        offset: Server's current estimate of client minus server clock (optional),
+            which the client uses to convert execute-at times
+
+    Returns:
+        bytes: Encoded message ready to send
+    """
+    return json.dumps({'type': 'clock_ping', 'seq': seq, 't0': sync_clock(),
+                       'offset': offset}).encode()
+
+
+def encode_clock_pong(ping, receive_time):
+    """Encode the reply to a clock synchronization ping (client -> server, JSON).
+
+    Args:
+        ping: Decoded clock_ping message
+        receive_time: sync_clock() time at which the ping was received
+
+    Returns:
+        bytes: Encoded message ready to send
+    """
+    return json.dumps({'type': 'clock_pong', 'seq': ping['seq'], 't0': ping['t0'],
+                       't1': receive_time, 't2': sync_clock(),
+                       'clock_base': SYNC_CLOCK_BASE}).encode()
+
+
+def make_hello(codecs=CODECS, state_fields=STATE_FIELDS,
+               max_datagram_size=MAX_DATAGRAM_SIZE, max_command_rate=None, robot_id=None,
+               state_rate=None):
+    """Build the client handshake message advertising its capabilities.
+
+    Args:
+        codecs: Codecs the client can decode, in order of preference
+        state_fields: State fields the client can report
+        max_datagram_size: Largest datagram the client can receive (bytes)
+        max_command_rate: Highest command rate the client can follow in Hz (optional)
+        robot_id: Name identifying the robot on a multi-robot server (optional)
+        state_rate: Fixed rate in Hz at which the client publishes states, or None
+            if it sends states only after executing commands (optional)
+
+    Returns:
+        dict: Handshake message
+    """
+    return {
+        'status': 'ready',
+        'robot_id': robot_id,
+        'protocol_version': VERSION,
+        'codecs': list(codecs),
+        'state_fields': list(state_fields),
+        'max_datagram_size': max_datagram_size,
+        'max_command_rate': max_command_rate,
+        'state_rate': state_rate,
+    }
+
+
+def negotiate(hello, codecs=CODECS, state_fields=DEFAULT_STATE_FIELDS,
+              max_datagram_size=MAX_DATAGRAM_SIZE, command_rate=None):
+    """Pick session settings supported by both the server and the client.
+
+    Args:
+        hello: Handshake message received from the client
+        codecs: Codecs the server can use, in order of preference
+        state_fields: State fields the server wants to receive
+        max_datagram_size: Largest datagram the server can receive (bytes)
+        command_rate: Target command rate in Hz (optional)
+
+    Returns:
+        dict: Agreed protocol_version, codec, state_fields, max_datagram_size and
+            command_rate, plus the client's state_rate
+    """
+    version = min(hello.get('protocol_version', LEGACY_VERSION), VERSION)
+    if version < VERSION:
+        # Legacy clients only understand JSON and report every state field
+        return {
+            'protocol_version': version,
+            'codec': CODEC_JSON,
+            'state_fields': list(STATE_FIELDS),
+            'max_datagram_size': LEGACY_MAX_DATAGRAM_SIZE,
+            'command_rate': command_rate,
+            'state_rate': None,
+        }
+
+    client_codecs = hello.get('codecs', [CODEC_JSON])
+    codec = next((c for c in codecs if c in client_codecs), None)
+    if codec is None:
+        raise ValueError(f"No common codec (server: {list(codecs)}, client: {client_codecs})")
+
+    client_fields = hello.get('state_fields', STATE_FIELDS)
+    max_command_rate = hello.get('max_command_rate')
+    if command_rate is not None and max_command_rate is not None:
+        command_rate = min(command_rate, max_command_rate)
+
+    return {
+        'protocol_version': version,
+        'codec': codec,
+        'state_fields': [f for f in state_fields if f in client_fields],
+        'max_datagram_size': min(max_datagram_size,
+                                 hello.get('max_datagram_size', LEGACY_MAX_DATAGRAM_SIZE)),
+        'command_rate': command_rate,
+        'state_rate': hello.get('state_rate'),
+    }
+
+
+def add_ee_pose(robot_states):
+    """Add ee_pose ([x, y, z, qx, qy, qz, qw]) to robot states that only have its parts.
+
+    Args:
+        robot_states: Robot states dictionary, updated in place
+
+    Returns:
+        dict: robot_states
+    """
+    if ('ee_pose' not in robot_states and robot_states.get('ee_position') is not None
+            and robot_states.get('ee_orientation') is not None):
+        robot_states['ee_pose'] = np.concatenate((robot_states['ee_position'],
+                                                  robot_states['ee_orientation']))
+    return robot_states
+
+
+def is_binary(data):
+    """Check whether a received datagram uses the binary codec."""
+    return len(data) > 0 and data[0] == MAGIC
+
+
+def decode_message(data, copy=False):
+    """Decode a received datagram of either codec.
+
+    Binary values are decoded with np.frombuffer as NumPy arrays that are
+    views into data, so a receive buffer that is reused must not be
+    overwritten while they are in use unless copy is set.
+
+    Args:
+        data: Raw datagram (bytes, bytearray or memoryview)
+        copy: Copy binary values out of data (one copy per message) (default: False)
+
+    Returns:
+        dict: Message with at least a 'type' key ('data' holds command values)
+    """
+    if not is_binary(data):
+        return json.loads(bytes(data))
+
+    if len(data) < HEADER.size:
+        raise ValueError(f"Truncated binary message ({len(data)} bytes)")
+
+    magic, version, type_id, seq, timestamp, count = HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f"Unsupported protocol version: {version}")
+    if type_id == STATES_TYPE:
+        return _decode_states(data, seq, timestamp, count, copy)
+    if type_id & CHUNK_FLAG:
+        return _decode_chunk(data, type_id & ~CHUNK_FLAG, seq, timestamp, count, copy)
+    timed = type_id & TIMED_FLAG
+    type_id &= ~TIMED_FLAG
+    if type_id not in TYPE_NAMES:
+        raise ValueError(f"Unknown binary message type: {type_id}")
+
+    offset = HEADER.size + (EXECUTE_AT.size if timed else 0)
+    if len(data) != offset + 8 * count:
+        raise ValueError(f"Binary message length mismatch ({len(data)} bytes for {count} values)")
+
+    values = np.frombuffer(data, dtype='<f8', count=count, offset=offset)
+    message = {'type': TYPE_NAMES[type_id], 'seq': seq, 't': timestamp,
+               'data': values.copy() if copy else values}
+    if timed:
+        message['execute_at'] = EXECUTE_AT.unpack_from(data, HEADER.size)[0]
+    return message
+
+
+def _decode_chunk(data, type_id, seq, timestamp, count, copy):
+    """Decode the body of a binary trajectory chunk."""
+    if type_id not in TYPE_NAMES:
+        raise ValueError(f"Unknown binary message type: {type_id}")
+    if len(data) < HEADER.size + CHUNK_DIM.size:
+        raise ValueError(f"Truncated trajectory chunk ({len(data)} bytes)")
+
+    dim = CHUNK_DIM.unpack_from(data, HEADER.size)[0]
+    row = dim + 1
+    offset = HEADER.size + CHUNK_DIM.size
+    if len(data) != offset + 8 * count * row:
+        raise ValueError(f"Trajectory chunk length mismatch ({len(data)} bytes for "
+                         f"{count} waypoints of {dim} values)")
+
+    # Rows of [execute-at time, value_1, ..., value_D]
+    values = np.frombuffer(data, dtype='<f8', count=count * row, offset=offset).reshape(count, row)
+    if copy:
+        values = values.copy()
+    return {'type': 'trajectory_chunk', 'mode': TYPE_NAMES[type_id], 'seq': seq,
+            't': timestamp, 'times': values[:, 0], 'data': values[:, 1:]}
+
+
+def _decode_states(data, seq, timestamp, count, copy):
+    """Decode the body of a binary robot states message into NumPy arrays."""
+    if len(data) < HEADER.size + STATE_HEAD.size:
+        raise ValueError(f"Truncated robot states ({len(data)} bytes)")
+
+    ack_seq, ack_t, mask = STATE_HEAD.unpack_from(data, HEADER.size)
+    fields = [field for bit, field in enumerate(STATE_FIELDS) if mask & (1 << bit)]
+    offset = HEADER.size + STATE_HEAD.size
+    lengths = data[offset:offset + len(fields)]
+    offset += len(fields)
+    if len(lengths) != len(fields) or sum(lengths) != count or len(data) != offset + 8 * count:
+        raise ValueError(f"Robot states length mismatch ({len(data)} bytes for {count} values)")
+
+    values = np.frombuffer(data, dtype='<f8', count=count, offset=offset)
+    if copy:
+        values = values.copy()
+    robot_states = {}
+    start = 0
+    for field, length in zip(fields, lengths):
+        robot_states[field] = values[start:start + length]
+        start += length
+
+    if ack_t != ack_t:  # NaN: no command acknowledged yet
+        ack_seq = ack_t = None
+    return {'type': 'robot_states', 'seq': seq, 't': timestamp,
+            'ack_seq': ack_seq, 'ack_t': ack_t, 'data': robot_states}
+
+
+class StateBuffer:
+    """Preallocated binary robot states message that is filled in place.
+
+    The layout is fixed at construction, so each cycle only the field values,
+    sequence number, timestamp and acknowledgement are written into the same
+    bytearray, which can be passed to sendto as is. The field values are
+    writable NumPy views into the buffer.
+    """
+
+    def __init__(self, field_lengths):
+        """Initialize the buffer.
+
+        Args:
+            field_lengths: Dict mapping state fields to their number of values;
+                fields not in STATE_FIELDS are ignored
+        """
+        fields = [field for field in STATE_FIELDS if field in field_lengths]
+        lengths = bytes(field_lengths[field] for field in fields)
+        self.count = sum(lengths)
+        self.mask = sum(1 << STATE_FIELDS.index(field) for field in fields)
+
+        offset = HEADER.size + STATE_HEAD.size
+        self.buffer = bytearray(offset + len(lengths) + 8 * self.count)
+        self.buffer[offset:offset + len(lengths)] = lengths
+        values = np.frombuffer(self.buffer, dtype='<f8', count=self.count,
+                               offset=offset + len(lengths))
+
+        # Field name -> view of its values in the buffer
+        self.fields = {}
+        start = 0
+        for field, length in zip(fields, lengths):
+            self.fields[field] = values[start:start + length]
+            start += length
+
+    def pack(self, seq, timestamp=None, ack_seq=None, ack_t=None):
+        """Write the header and acknowledgement for the current field values.
+
+        Args:
+            seq: Sequence number of the message
+            timestamp: Send time from time.monotonic() (default: now)
+            ack_seq: Sequence number of the last command received (optional)
+            ack_t: Send timestamp of the last command received (optional)
+
+        Returns:
+            bytearray: The message buffer, ready to send
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        HEADER.pack_into(self.buffer, 0, MAGIC, VERSION, STATES_TYPE, seq & SEQ_MASK,
+                         timestamp, self.count)
+        STATE_HEAD.pack_into(self.buffer, HEADER.size,
+                             0 if ack_seq is None else ack_seq & SEQ_MASK,
+                             float('nan') if ack_t is None else ack_t, self.mask)
+        return self.buffer
+
+
+class SequenceTracker:
+    """Track sequence numbers of received messages.
+
+    Only messages newer than the newest one seen so far are accepted. A 64-message
+    window remembers which older sequence numbers arrived, so late packets can be
+    told apart from duplicates and removed from the loss count. Only gaps after
+    the first accepted message count as lost, so only those are credited back.
+
+    Sequence numbers are 32-bit (SEQ_MASK) and compared with serial number
+    arithmetic: a number up to half the sequence space ahead of the newest one
+    is newer, so numbering continues across wraparound. A peer that restarts its
+    numbering must be tracked anew (reset(), e.g. on a new handshake).
+    """
+
+    WINDOW = 64
+    # Serial number distance beyond which a sequence number counts as older
+    HALF_RANGE = (SEQ_MASK + 1) // 2
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget all sequence numbers and counters (e.g. after the peer restarted)."""
+        self.last_seq = None
+        self._window = 0
+        # Window positions from the first accepted message on (counted as received or lost)
+        self._tracked = 0
+        self.received = 0
+        self.lost = 0
+        self.reordered = 0
+        self.duplicates = 0
+
+    def accept(self, seq):
+        """Record a received sequence number.
+
+        Args:
+            seq: Sequence number of the received message
+
+        Returns:
+            bool: True if the message is the newest so far and should be used
+        """
+        seq &= SEQ_MASK
+        if self.last_seq is None:
+            self._window = 1
+            self._tracked = 1
+            self.last_seq = seq
+            self.received += 1
+            return True
+
+        gap = (seq - self.last_seq) & SEQ_MASK
+        if 0 < gap < self.HALF_RANGE:
+            self.lost += gap - 1
+            if gap >= self.WINDOW:
+                self._window = 1
+            else:
+                self._window = ((self._window << gap) | 1) & ((1 << self.WINDOW) - 1)
+            self._tracked = min(self._tracked + gap, self.WINDOW)
+            self.last_seq = seq
+            self.received += 1
+            return True
+
+        offset = (self.last_seq - seq) & SEQ_MASK
+        if offset < self.WINDOW and self._window & (1 << offset):
+            self.duplicates += 1
+        else:
+            # Arrived late: no longer lost, but too old to use
+            if offset < self.WINDOW:
+                self._window |= 1 << offset
+                if offset < self._tracked:
+                    self.lost -= 1
+            self.reordered += 1
+            self.received += 1
+        return False
+
+    def get_counters(self):
+        """Get loss/reorder/duplicate counters.
+
+        Returns:
+            dict: Counters for received, lost, reordered and duplicate messages
+        """
+        return {
+            'received': self.received,
+            'lost': self.lost,
+            'reordered': self.reordered,
+            'duplicates': self.duplicates,
+        }
+
+
+class RunningStats:
+    """Running count/mean/std/min/max of a measured quantity (e.g. latency in seconds)."""
+
+    def __init__(self):
+        self.count = 0
+        self.last = None
+        self.mean = 0.0
+        self.min = None
+        self.max = None
+        self._m2 = 0.0
+
+    def add(self, value):
+        """Add a sample."""
+        self.count += 1
+        self.last = value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def std(self):
+        """Standard deviation of the samples."""
+        return (self._m2 / self.count) ** 0.5 if self.count else 0.0
+
+    def as_dict(self):
+        """Get the statistics as a dictionary."""
+        return {'count': self.count, 'last': self.last, 'mean': self.mean, 'std': self.std,
+                'min': self.min, 'max': self.max}
+
+
+class ClockSync:
+    """Estimate offset and drift of a peer's sync_clock() from ping/pong exchanges.
+
+    Each exchange gives the NTP-style offset ((t1 - t0) + (t2 - t3)) / 2 and
+    round-trip delay (t3 - t0) - (t2 - t1), where t0/t3 are local send/receive
+    times and t1/t2 the peer's receive/send times. The sample with the smallest
+    delay is the most accurate; drift is the least-squares slope of the offsets
+    of the recent low-delay samples. Offset noise of a fraction of a millisecond
+    over a short span would give a meaningless slope, so drift is only estimated
+    once those samples span min_baseline seconds.
+    """
+
+    # Seconds the samples must span before drift is estimated
+    DRIFT_MIN_BASELINE = 10.0
+
+    def __init__(self, window=64, min_baseline=DRIFT_MIN_BASELINE):
+        """Initialize the estimator.
+
+        Args:
+            window: Number of recent samples used for the estimate (default: 64)
+            min_baseline: Seconds the samples must span before drift is
+                estimated (default: DRIFT_MIN_BASELINE)
+        """
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.min_baseline = min_baseline
+
+    def add_sample(self, t0, t1, t2, t3):
+        """Add one ping/pong exchange.
+
+        Args:
+            t0: Local time the ping was sent
+            t1: Peer time the ping was received
+            t2: Peer time the pong was sent
+            t3: Local time the pong was received
+        """
+        delay = (t3 - t0) - (t2 - t1)
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+        self.samples.append((t3, offset, delay))
+        self.count += 1
+
+    @property
+    def ready(self):
+        """True once at least one sample has been received."""
+        return len(self.samples) > 0
+
+    def _best_samples(self):
+        """Samples whose delay is within twice the minimum delay."""
+        min_delay = min(delay for _, _, delay in self.samples)
+        return [sample for sample in self.samples if sample[2] <= 2 * min_delay + 1e-4]
+
+    @property
+    def drift(self):
+        """Rate of change of the offset (seconds per second, 0 if unknown)."""
+        samples = self._best_samples() if self.ready else []
+        if len(samples) < 2:
+            return 0.0
+        if samples[-1][0] - samples[0][0] < self.min_baseline:
+            return 0.0
+        mean_t = sum(t for t, _, _ in samples) / len(samples)
+        mean_offset = sum(offset for _, offset, _ in samples) / len(samples)
+        var_t = sum((t - mean_t) ** 2 for t, _, _ in samples)
+        return sum((t - mean_t) * (offset - mean_offset) for t, offset, _ in samples) / var_t
+
+    def offset(self, at=None):
+        """Estimated peer clock minus local clock (seconds).
+
+        Args:
+            at: Local time to extrapolate the offset to with the drift (default: now)
+        """
+        if not self.ready:
+            return None
+        best_t, best_offset, _ = min(self.samples, key=lambda sample: sample[2])
+        if at is None:
+            at = sync_clock()
+        return best_offset + self.drift * (at - best_t)
+
+    def to_peer(self, t):
+        """Convert a local sync_clock() time to the peer's clock."""
+        return t + self.offset(t)
+
+    def from_peer(self, t):
+        """Convert a peer sync_clock() time to the local clock."""
+        return t - self.offset(t)
+
+    def as_dict(self):
+        """Get the current estimate as a dictionary."""
+        if not self.ready:
+            return {'samples': self.count, 'offset': None, 'drift': 0.0, 'delay': None}
+        return {
+            'samples': self.count,
+            'offset': self.offset(),
+            'drift': self.drift,
+            'delay': min(delay for _, _, delay in self.samples),
+        }
@@ -1,27 +1,42 @@
 """UDP Server - Sends target joint positions from a text file."""
-import socket
+import asyncio
 import time
 import json
+import threading
+from collections import deque
 
+import numpy as np
 
-class RobotCommandServer:
-    """UDP Server class for sending commands to and receiving states from a Franka robot."""
+import protocol
+import trajectory_file
+from shm_transport import SharedMemoryTransport
+from state_store import StateRingBuffer
+from transport import TcpTransport, Transport, UdpTransport, UnixDatagramTransport
+
+
+class RobotSession:
+    """State of one connected robot client.
     
-    def __init__(self, server_host='0.0.0.0', server_port=5000, verbose=True):
-        """Initialize the robot command server.
+    Holds the settings negotiated in the handshake, the control mode, command
+    sequence numbering, received states and statistics of a single client.
+    """
+    
+    def __init__(self, client_address, settings, robot_id=None, control_mode=None,
+                 state_history_size=1000):
+        """Initialize a robot session.
         
         Args:
-            server_host: Host address to bind the server socket (default: '0.0.0.0')
-            server_port: Port number for the server socket (default: 5000)
-            verbose: Enable verbose output (default: True)
+            client_address: Address the client sends from
+            settings: Session settings agreed in the handshake (see protocol.negotiate)
+            robot_id: Robot ID announced by the client (optional)
+            control_mode: Control mode sent to the client (optional)
+            state_history_size: Number of received states kept in state_history (default: 1000)
         """
-        self.server_host = server_host
-        self.server_port = server_port
-        self.verbose = verbose
-        
-        # Initialize UDP socket
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.bind((self.server_host, self.server_port))
+        self.client_address = client_address
+        self.robot_id = robot_id
+        self.settings = settings
+        self.codec = settings['codec']
+        self.control_mode = control_mode
         
         # Store latest robot states from client
         self.robot_states = {
@@ -32,12 +47,176 @@ class RobotCommandServer:
             'ee_orientation': []
         }
         
-        # Store client address and control mode
+        # Recent states as (receive time, seq, robot states), oldest first, and
+        # the same states as rows of a NumPy structured array for analysis
+        self.state_history = deque(maxlen=state_history_size)
+        self.state_store = StateRingBuffer(state_history_size)
+        self.state_count = 0
+        
+        # Sequence numbering and packet loss/latency accounting
+        self.command_seq = 0
+        self.state_tracker = protocol.SequenceTracker()
+        self.rtt_stats = protocol.RunningStats()
+        self.one_way_stats = protocol.RunningStats()
+        self._last_ack_seq = None
+        
+        # Interval between received states, to check the client's publish rate
+        self.state_interval_stats = protocol.RunningStats()
+        self._last_state_time = None
+        
+        # Clock synchronization: client sync_clock() relative to ours, and the
+        # client's SYNC_CLOCK_BASE to map its monotonic timestamps onto it
+        self.clock = protocol.ClockSync()
+        self.clock_ping_seq = 0
+        self.client_clock_base = None
+    
+    @property
+    def name(self):
+        """Robot ID if the client announced one, otherwise its address."""
+        return self.robot_id if self.robot_id is not None else self.client_address
+    
+    def accept_state(self, message):
+        """Check the sequence number of a state message and record its latency.
+        
+        Args:
+            message: Decoded robot states message
+            
+        Returns:
+            bool: False if the message is older than the latest accepted state
+        """
+        receive_time = time.monotonic()
+        
+        # Messages from clients without sequence numbers are always accepted
+        if message.get('seq') is None:
+            return True
+        if not self.state_tracker.accept(message['seq']):
+            return False
+        
+        if self._last_state_time is not None:
+            self.state_interval_stats.add(receive_time - self._last_state_time)
+        self._last_state_time = receive_time
+        
+        # One-way delay needs the client's send time on our clock, which the clock
+        # synchronization provides; round-trip time uses the echoed command
+        # timestamp on the server clock
+        if message.get('t') is not None and self.clock.ready and self.client_clock_base is not None:
+            send_time = self.clock.from_peer(message['t'] + self.client_clock_base)
+            self.one_way_stats.add(receive_time + protocol.SYNC_CLOCK_BASE - send_time)
+        ack_seq = message.get('ack_seq')
+        if message.get('ack_t') is not None and ack_seq != self._last_ack_seq:
+            self._last_ack_seq = ack_seq
+            self.rtt_stats.add(receive_time - message['ack_t'])
+        return True
+    
+    def add_clock_pong(self, message):
+        """Record a clock_pong reply to one of our pings."""
+        self.clock.add_sample(message['t0'], message['t1'], message['t2'], protocol.sync_clock())
+        self.client_clock_base = message.get('clock_base')
+    
+    def store_state(self, message):
+        """Store an accepted robot states message as the latest state."""
+        receive_time = time.monotonic()
+        self.robot_states = protocol.add_ee_pose(message['data'])
+        self.state_history.append((receive_time, message.get('seq'), self.robot_states))
+        self.state_store.append(receive_time, message.get('seq'), self.robot_states)
+        self.state_count += 1
+    
+    def get_statistics(self):
+        """Get packet accounting and latency statistics for received states.
+        
+        Returns:
+            dict: Commands sent, state loss/reorder/duplicate counters, the
+                client's announced state rate (Hz) and round-trip/one-way latency
+                and state interval statistics (seconds)
+        """
+        return {
+            'commands_sent': self.command_seq,
+            'states': self.state_tracker.get_counters(),
+            'state_rate': self.settings.get('state_rate'),
+            'state_interval': self.state_interval_stats.as_dict(),
+            'rtt': self.rtt_stats.as_dict(),
+            'one_way': self.one_way_stats.as_dict(),
+        }
+
+
+class BaseRobotCommandServer:
+    """Transport independent part of the robot command server.
+    
+    Holds the handshake negotiation, command encoding, session table and
+    statistics shared by RobotCommandServer and AsyncRobotCommandServer.
+    
+    Every client that completes a handshake gets a RobotSession, keyed by its
+    address, so one server socket can drive several robots. Methods taking a
+    robot argument accept a client address or a robot ID; None selects the
+    client that completed the most recent handshake.
+    """
+    
+    # Highest supported streaming rate (Hz)
+    MAX_STREAM_RATE = 1000.0
+    # Lateness, as a fraction of the period, above which a deadline counts as missed
+    MISS_TOLERANCE = 0.1
+    
+    def __init__(self, server_host='0.0.0.0', server_port=5000, verbose=True, codec='binary',
+                 command_rate=None, state_fields=protocol.DEFAULT_STATE_FIELDS,
+                 max_datagram_size=protocol.MAX_DATAGRAM_SIZE, state_history_size=1000,
+                 trajectory_cache=None):
+        """Initialize server settings and the session table.
+        
+        Args:
+            server_host: Host address to bind the server socket (default: '0.0.0.0')
+            server_port: Port number for the server socket (default: 5000)
+            verbose: Enable verbose output (default: True)
+            codec: Preferred command encoding, 'binary' or 'json' (default: 'binary').
+                'binary' falls back to JSON for clients that do not support it;
+                'json' forces JSON for debugging.
+            command_rate: Target command rate in Hz announced in the handshake (optional)
+            state_fields: Robot state fields to request from the client (default:
+                protocol.DEFAULT_STATE_FIELDS; ee_pose is derived from ee_position
+                and ee_orientation when not requested)
+            max_datagram_size: Largest datagram the server accepts in bytes (default: 4096)
+            state_history_size: Number of received states kept per robot (default: 1000)
+            trajectory_cache: trajectory_cache.TrajectoryCache that read_commands_file
+                keeps parsed text command files in (default: no cache)
+        """
+        if codec not in protocol.CODECS:
+            raise ValueError(f"Unknown codec: {codec}")
+        
+        self.server_host = server_host
+        self.server_port = server_port
+        self.verbose = verbose
+        self.codec = codec
+        self.command_rate = command_rate
+        self.state_fields = list(state_fields)
+        self.max_datagram_size = max_datagram_size
+        self.state_history_size = state_history_size
+        self.trajectory_cache = trajectory_cache
+        
+        # Connected robots keyed by client address, and robot ID -> client address
+        self.sessions = {}
+        self.robot_ids = {}
+        
+        # Address of the client that completed the most recent handshake
         self.client_address = None
-        self.control_mode = None
         
-        if self.verbose:
-            print(f"Server listening on {self.server_host}:{self.server_port}")
+        # Notified whenever any session stores a new state
+        self._state_condition = threading.Condition()
+    
+    @property
+    def session(self):
+        """Settings negotiated with the most recent client, or None before a handshake."""
+        session = self.sessions.get(self.client_address)
+        return session.settings if session else None
+    
+    @property
+    def control_mode(self):
+        """Control mode of the most recent client."""
+        session = self.sessions.get(self.client_address)
+        return session.control_mode if session else None
+    
+    @property
+    def robot_states(self):
+        """Latest robot states of the most recent client."""
+        return self.get_latest_state()
     
     def read_commands_file(self, filename):
         """Read commands from text file.
@@ -50,30 +229,516 @@ class RobotCommandServer:
         - joint_torque: Control joint torques (7 values) [NOT IMPLEMENTED YET]
         - ee_force: Control end effector forces (6 values) [NOT IMPLEMENTED YET]
         
-        Subsequent lines contain the command values.
+        Subsequent lines contain the command values. A leading time column is
+        dropped; use trajectory_file.load_trajectory to get it.
+        
+        The commands are a float64 NumPy array of shape (N, D) whenever all
+        waypoints have the same length. Binary trajectory files (.npz, see
+        trajectory_file.convert_commands_file) are memory-mapped rather than
+        read, so their pages are read from disk as they are streamed; with a
+        trajectory_cache, text files parsed before are memory-mapped from the
+        cache in the same way. Only files that mix waypoint lengths (e.g.
+        ee_position with and without orientation) give a list of command
+        value lists instead.
         
         Args:
             filename: Path to the commands file
             
         Returns:
-            tuple: (control_mode, list of command arrays)
+            tuple: (control_mode, commands) with commands an (N, D) array, or
+                a list of lists if the waypoint lengths differ
+        """
+        if str(filename).endswith(trajectory_file.BINARY_SUFFIX):
+            control_mode, values, _ = trajectory_file.load_trajectory(filename)
+            return control_mode, values
+        try:
+            if self.trajectory_cache is not None:
+                control_mode, values, _ = self.trajectory_cache.load(filename)
+                return control_mode, values
+            control_mode, values, _ = trajectory_file.load_trajectory(filename)
+        except ValueError:
+            # Waypoints of different lengths (e.g. ee_position with and
+            # without orientation) do not fit one array
+            control_mode, commands, _ = trajectory_file.read_commands(filename)
+            return control_mode, commands
+        return control_mode, values
+    
+    def get_session(self, robot=None):
+        """Look up the session of a connected robot.
+        
+        Args:
+            robot: Client address or robot ID (default: most recent client)
+            
+        Returns:
+            RobotSession: Session of the robot
+        """
+        if robot is None:
+            robot = self.client_address
+            if robot is None:
+                raise ValueError("No client address available. Complete handshake first.")
+        robot = self.robot_ids.get(robot, robot) if isinstance(robot, str) else robot
+        
+        session = self.sessions.get(robot)
+        if session is None:
+            raise ValueError(f"Unknown robot: {robot}")
+        return session
+    
+    @staticmethod
+    def _decode_hello(data):
+        """Decode a datagram if it is a client's handshake (hello).
+        
+        Returns:
+            dict: The hello message, or None for anything else (robot states,
+                binary messages, undecodable data)
+        """
+        if protocol.is_binary(data):
+            return None
+        try:
+            message = json.loads(bytes(data))
+        except ValueError:
+            # Includes UnicodeDecodeError
+            return None
+        if isinstance(message, dict) and 'status' in message:
+            return message
+        return None
+    
+    def _send(self, message, client_address):
+        """Send a message to a client over the server's transport."""
+        raise NotImplementedError
+    
+    def _renegotiate(self, handshake_msg, session):
+        """Renegotiate with a known client that re-sent its handshake (e.g. after a restart).
+        
+        The client gets a fresh session, so its sequence numbering restarts,
+        keeps its control mode and gets a handshake response.
+        """
+        response = self._negotiate(handshake_msg, session.client_address, session.control_mode,
+                                   make_default=False)
+        if response is not None:
+            self._send(response, session.client_address)
+    
+    def _negotiate(self, handshake_msg, client_address, control_mode=None, make_default=True):
+        """Agree on session settings with a client that sent a handshake.
+        
+        Creates (or replaces) the client's session and, unless make_default is
+        False, makes it the default robot.
+        
+        Args:
+            handshake_msg: Decoded handshake message from the client
+            client_address: Address the handshake came from
+            control_mode: Control mode to send to client (optional)
+            make_default: Make this client the default robot (default: True)
+            
+        Returns:
+            bytes: Handshake response to send, or None if no control mode was given
+        """
+        if self.verbose:
+            print(f"Client connected from {client_address}: {handshake_msg}")
+        
+        # Agree on protocol settings; a 'json' preference excludes the binary codec
+        codecs = protocol.CODECS if self.codec == protocol.CODEC_BINARY else (protocol.CODEC_JSON,)
+        settings = protocol.negotiate(handshake_msg, codecs=codecs,
+                                      state_fields=self.state_fields,
+                                      max_datagram_size=self.max_datagram_size,
+                                      command_rate=self.command_rate)
+        
+        robot_id = handshake_msg.get('robot_id')
+        session = RobotSession(client_address, settings, robot_id=robot_id,
+                               control_mode=control_mode or None,
+                               state_history_size=self.state_history_size)
+        with self._state_condition:
+            self.sessions[client_address] = session
+            if robot_id is not None:
+                self.robot_ids[robot_id] = client_address
+            if make_default or self.client_address is None:
+                self.client_address = client_address
+        
+        if self.verbose:
+            print(f"Negotiated session with {session.name}: {settings}")
+        
+        if not control_mode:
+            return None
+        return json.dumps({'type': 'handshake', 'control_mode': control_mode,
+                           **settings}).encode()
+    
+    def _encode_command(self, control_mode, command_values, session, execute_at=None):
+        """Encode the next command of a session with a new sequence number.
+        
+        Returns:
+            bytes: Encoded command message
+        """
+        session.command_seq += 1
+        message = protocol.encode_command(control_mode, command_values, session.codec,
+                                          seq=session.command_seq, execute_at=execute_at)
+        
+        max_size = session.settings['max_datagram_size']
+        if len(message) > max_size:
+            raise ValueError(f"Command of {len(message)} bytes exceeds negotiated maximum "
+                             f"datagram size of {max_size} bytes")
+        
+        if self.verbose:
+            print(f"Sent {control_mode} to {session.name}: {command_values}")
+        
+        return message
+    
+    def _encode_chunk(self, control_mode, times, waypoints, session):
+        """Encode a trajectory chunk for a session with a new sequence number.
+        
+        Returns:
+            bytes: Encoded trajectory chunk message
+        """
+        session.command_seq += 1
+        message = protocol.encode_trajectory_chunk(control_mode, times, waypoints, session.codec,
+                                                   seq=session.command_seq)
+        
+        max_size = session.settings['max_datagram_size']
+        if len(message) > max_size:
+            raise ValueError(f"Trajectory chunk of {len(message)} bytes exceeds negotiated "
+                             f"maximum datagram size of {max_size} bytes")
+        
+        if self.verbose:
+            print(f"Sent {len(waypoints)} {control_mode} waypoints to {session.name}")
+        
+        return message
+    
+    def _chunk_size(self, dim, session, chunk_size=None):
+        """Waypoints of dim values per trajectory chunk that fit in one MTU-sized datagram."""
+        max_size = min(session.settings['max_datagram_size'], protocol.MTU_PAYLOAD)
+        fit = protocol.max_chunk_waypoints(dim, max_size, session.codec)
+        if chunk_size is None:
+            return fit
+        if not 0 < chunk_size <= fit:
+            raise ValueError(f"Chunk size must be in (0, {fit}] waypoints, got {chunk_size}")
+        return chunk_size
+    
+    def _timed_chunks(self, commands, offsets, session, chunk_size=None):
+        """Split waypoints into chunks of waypoints of one length that fit in one datagram."""
+        if isinstance(commands, np.ndarray):
+            size = self._chunk_size(commands.shape[1], session, chunk_size)
+            for first in range(0, len(commands), size):
+                yield commands[first:first + size], offsets[first:first + size]
+            return
+        first = 0
+        while first < len(commands):
+            dim = len(commands[first])
+            size = self._chunk_size(dim, session, chunk_size)
+            last = first + 1
+            while last < len(commands) and last - first < size and len(commands[last]) == dim:
+                last += 1
+            yield commands[first:last], offsets[first:last]
+            first = last
+    
+    def _trajectory_chunks(self, commands, offsets, session, chunk_size=None):
+        """Check waypoint offsets and split the waypoints into chunks (see _timed_chunks).
+        
+        Returns:
+            tuple: (iterator of (waypoints, offsets) chunks, chunk size of the
+                first waypoint length, for the report)
+        """
+        if np.any(np.diff(offsets) < 0):
+            raise ValueError("Waypoint times must not decrease")
+        chunks = self._timed_chunks(commands, offsets, session, chunk_size)
+        return chunks, self._chunk_size(len(commands[0]), session, chunk_size)
+    
+    def _chunk_messages(self, control_mode, chunks, start_at, session):
+        """Encode (waypoints, offsets) chunks with execute-at times start_at + offsets.
+        
+        Yields:
+            tuple: (offset of the chunk's first waypoint, encoded message,
+                number of waypoints)
+        """
+        last = 0.0
+        for waypoints, offsets in chunks:
+            if offsets[0] < last or np.any(np.diff(offsets) < 0):
+                raise ValueError("Waypoint times must not decrease")
+            last = offsets[-1]
+            message = self._encode_chunk(control_mode, start_at + offsets, waypoints, session)
+            yield offsets[0], message, len(waypoints)
+    
+    def _stream_rate(self, rate, session):
+        """Resolve and validate the rate for stream_commands."""
+        if rate is None:
+            rate = session.settings['command_rate']
+        if rate is None or not 0 < rate <= self.MAX_STREAM_RATE:
+            raise ValueError(f"Stream rate must be in (0, {self.MAX_STREAM_RATE}] Hz, got {rate}")
+        return rate
+    
+    def _stream_report(self, rate, total, sent, skipped, missed, lateness, start):
+        """Build the timing report returned by stream_commands."""
+        report = {
+            'rate': rate,
+            'sent': sent,
+            'skipped': skipped,
+            'missed_deadlines': missed,
+            'duration': time.monotonic() - start,
+            'lateness': lateness.as_dict(),
+            'jitter': lateness.std,
+        }
+        if self.verbose:
+            print(f"Streamed {sent}/{total} commands at {rate} Hz: "
+                  f"{missed} missed deadlines, jitter {lateness.std * 1e6:.1f} us")
+        return report
+    
+    def _synchronized_ticks(self, trajectories):
+        """Group per-robot trajectories into ticks of (session, command) pairs.
+        
+        Returns:
+            tuple: (list of sessions, list of ticks)
+        """
+        if not trajectories:
+            raise ValueError("No trajectories to stream")
+        sessions = [self.get_session(robot) for robot in trajectories]
+        commands = list(trajectories.values())
+        ticks = [[(session, robot_commands[i]) for session, robot_commands in zip(sessions, commands)
+                  if i < len(robot_commands)]
+                 for i in range(max(len(robot_commands) for robot_commands in commands))]
+        return sessions, ticks
+    
+    def _process_state(self, data, client_address):
+        """Decode a received datagram and store it if it holds new robot states.
+        
+        Args:
+            data: Raw datagram bytes
+            client_address: Address the datagram came from
+            
+        Returns:
+            RobotSession: Session that stored new states, or None if not a new state message
+        """
+        session = self.sessions.get(client_address)
+        if session is None:
+            if self.verbose:
+                print(f"Ignoring datagram from unknown client {client_address}")
+            return None
+        
+        handshake_msg = self._decode_hello(data)
+        if handshake_msg is not None:
+            self._renegotiate(handshake_msg, session)
+            return None
+        
+        try:
+            # States outlive the (possibly reused) receive buffer: copy their
+            # values out once, as one array
+            message = protocol.decode_message(data, copy=True)
+            
+            if message.get('type') == 'clock_pong':
+                with self._state_condition:
+                    session.add_clock_pong(message)
+                    self._state_condition.notify_all()
+                return None
+            
+            if message.get('type') == 'robot_states':
+                if not session.accept_state(message):
+                    if self.verbose:
+                        print(f"Dropped stale robot states from {session.name} (seq {message.get('seq')})")
+                    return None
+                
+                with self._state_condition:
+                    session.store_state(message)
+                    self._state_condition.notify_all()
+                
+                if self.verbose:
+                    # Print received states in readable format
+                    # (fields not negotiated in the handshake are absent)
+                    robot_states = session.robot_states
+                    print(f"\n=== Received Robot States ({session.name}) ===")
+                    print(f"Joint Positions: {robot_states.get('joint_positions')}")
+                    print(f"Joint Velocities: {robot_states.get('joint_velocities')}")
+                    print(f"Joint Efforts (Torques): {robot_states.get('joint_efforts')}")
+                    print(f"End Effector Pose: {robot_states.get('ee_pose')}")
+                    print(f"End Effector Position: {robot_states.get('ee_position')}")
+                    print(f"End Effector Orientation (Quaternion): {robot_states.get('ee_orientation')}")
+                    print("============================\n")
+                
+                return session
+            else:
+                if self.verbose:
+                    print(f"Received unexpected message type: {message.get('type')}")
+                return None
+                
+        except Exception as e:
+            print(f"Error processing robot states: {e}")
+            return None
+    
+    def _clock_ping(self, session):
+        """Encode the next clock synchronization ping for a session.
+        
+        The ping carries the current offset estimate so the client can convert
+        execute-at times to its own clock.
+        """
+        session.clock_ping_seq += 1
+        return protocol.encode_clock_ping(session.clock_ping_seq, session.clock.offset())
+    
+    def _clock_sync_sessions(self):
+        """Sessions to ping periodically: protocol version 1 clients cannot parse pings."""
+        return [session for session in list(self.sessions.values())
+                if session.settings['protocol_version'] >= 2]
+    
+    def get_clock_sync(self, robot=None):
+        """Get the clock synchronization estimate for a robot.
+        
+        Args:
+            robot: Client address or robot ID (default: most recent client)
+            
+        Returns:
+            dict: Number of samples, 'offset' (client minus server clock, seconds,
+                None before the first exchange), 'drift' (seconds per second) and
+                minimum round-trip 'delay' (seconds)
+        """
+        return self.get_session(robot).clock.as_dict()
+    
+    def get_statistics(self, robot=None):
+        """Get packet accounting and latency statistics for a robot's states.
+        
+        Args:
+            robot: Client address or robot ID (default: most recent client)
+            
+        Returns:
+            dict: Commands sent, state loss/reorder/duplicate counters and
+                round-trip/one-way latency statistics (seconds)
+        """
+        return self.get_session(robot).get_statistics()
+    
+    def get_all_statistics(self):
+        """Get statistics of every connected robot.
+        
+        Returns:
+            dict: Statistics keyed by robot ID (or client address)
+        """
+        return {session.name: session.get_statistics() for session in list(self.sessions.values())}
+    
+    def get_latest_state(self, robot=None):
+        """Get the most recently received robot state without blocking.
+        
+        Args:
+            robot: Client address or robot ID (default: most recent client)
+            
+        Returns:
+            dict: Latest robot states dictionary
+        """
+        return self.get_session(robot).robot_states
+    
+    def get_state_history(self, n=None, robot=None):
+        """Get recently received robot states without blocking.
+        
+        Args:
+            n: Number of most recent states to return (default: all kept)
+            robot: Client address or robot ID (default: most recent client)
+            
+        Returns:
+            list: (receive time, seq, robot states) tuples, oldest first
+        """
+        session = self.get_session(robot)
+        with self._state_condition:
+            history = list(session.state_history)
+        return history if n is None else history[-n:]
+    
+    def get_state_store(self, robot=None):
+        """Get the NumPy ring buffer of received states (see state_store.StateRingBuffer).
+        
+        Its query results may be views that the receiver overwrites; use
+        get_states_between/get_last_states for copies taken under the state lock.
+        
+        Args:
+            robot: Client address or robot ID (default: most recent client)
+        """
+        return self.get_session(robot).state_store
+    
+    def get_states_between(self, t0, t1, robot=None):
+        """Get the states received in the time range [t0, t1] (time.monotonic()).
+        
+        Returns:
+            np.ndarray: Structured array (see state_store.state_dtype), oldest first
+        """
+        session = self.get_session(robot)
+        with self._state_condition:
+            return session.state_store.states_between(t0, t1).copy()
+    
+    def get_last_states(self, n, robot=None):
+        """Get the n most recently received states.
+        
+        Returns:
+            np.ndarray: Structured array (see state_store.state_dtype), oldest first
+        """
+        session = self.get_session(robot)
+        with self._state_condition:
+            return session.state_store.last_n(n).copy()
+
+
+class RobotCommandServer(BaseRobotCommandServer):
+    """UDP Server class for sending commands to and receiving states from a Franka robot."""
+    
+    # Remaining wait (s) below which the scheduler busy-waits instead of sleeping
+    SPIN_THRESHOLD = 0.0005
+    # Remaining wait (s) below which the scheduler stops blocking on the socket
+    # (socket timeouts have millisecond resolution)
+    POLL_MARGIN = 0.0015
+    # Receive timeout (s) of the background receiver, bounds how long stopping it takes
+    RECEIVER_POLL_INTERVAL = 0.1
+    
+    def __init__(self, server_host='0.0.0.0', server_port=5000, verbose=True, transport='udp',
+                 shm_name='robot', server_path=None, **kwargs):
+        """Initialize the robot command server.
+        
+        Args:
+            server_host: Host address to bind the server socket (default: '0.0.0.0')
+            server_port: Port number for the server socket (default: 5000)
+            verbose: Enable verbose output (default: True)
+            transport: 'udp', 'tcp', 'unix' (Unix datagram socket at server_path),
+                'shm' (a client on the same host connected through shared
+                memory, see shm_transport.py) or a transport.Transport instance
+                (default: 'udp')
+            shm_name: Shared memory link name, used with transport='shm' (default: 'robot')
+            server_path: Unix datagram socket path to bind in place of host and
+                port; selects transport='unix' (optional)
+            **kwargs: Protocol settings, see BaseRobotCommandServer
         """
-        control_mode = None
-        commands = []
+        super().__init__(server_host, server_port, verbose, **kwargs)
+        if server_path is not None and transport == 'udp':
+            transport = 'unix'
+        self.server_path = server_path
+        self.transport = self._open_transport(transport, shm_name)
         
-        with open(filename, 'r') as f:
-            for i, line in enumerate(f):
-                line = line.strip()
-                if line and not line.startswith('#'):  # Skip empty lines and comments
-                    if i == 0 or control_mode is None:
-                        # First non-comment line is the control mode
-                        control_mode = line.lower()
-                    else:
-                        # Parse command values
-                        values = [float(x.strip()) for x in line.split(',')]
-                        commands.append(values)
+        # Messages are received into one reused buffer; only one thread reads
+        # the transport at a time (the caller, or the background receiver)
+        self._recv_buffer = bytearray(self.max_datagram_size)
+        self._recv_view = memoryview(self._recv_buffer)
         
-        return control_mode, commands
+        # Background state receiver (see start_receiver)
+        self._receiver_thread = None
+        self._receiver_running = False
+        self._clock_sync_interval = None
+        
+        if self.verbose:
+            if transport == 'shm':
+                print(f"Server listening on shared memory link '{shm_name}'")
+            elif transport == 'unix':
+                print(f"Server listening on Unix socket {self.server_path}")
+            elif isinstance(transport, str):
+                print(f"Server listening on {transport} {self.server_host}:{self.server_port}")
+            else:
+                print(f"Server listening on {type(transport).__name__}")
+    
+    def _send(self, message, client_address):
+        self.transport.send(message, client_address)
+    
+    def _open_transport(self, transport, shm_name):
+        """Create the transport selected by name, or use a given Transport."""
+        if isinstance(transport, Transport):
+            return transport
+        if transport == 'udp':
+            return UdpTransport(self.server_host, self.server_port)
+        if transport == 'tcp':
+            return TcpTransport(self.server_host, self.server_port, server=True)
+        if transport == 'unix':
+            if self.server_path is None:
+                raise ValueError("transport='unix' requires server_path")
+            # Same datagram semantics as UDP, without the IP stack
+            return UnixDatagramTransport(self.server_path)
+        if transport == 'shm':
+            # Same message semantics as UDP, through shared memory rings
+            return SharedMemoryTransport(shm_name, server=True,
+                                         max_message_size=self.max_datagram_size)
+        raise ValueError(f"Unknown transport: {transport}")
     
     def wait_for_handshake(self, control_mode=None):
         """Wait for client connection and complete handshake.
@@ -84,120 +749,850 @@ class RobotCommandServer:
         Returns:
             tuple: (client_address, handshake_message)
         """
+        if self._receiver_running:
+            raise ValueError("Complete handshakes before starting the background receiver.")
+        
         if self.verbose:
             print("Waiting for client connection...")
         
-        data, self.client_address = self.sock.recvfrom(1024)
-        handshake_msg = json.loads(data.decode())
-        
-        if self.verbose:
-            print(f"Client connected from {self.client_address}: {handshake_msg}")
+        # States from already connected robots keep being processed meanwhile;
+        # anything else from unknown clients (e.g. states of a client left over
+        # from a previous run) is ignored
+        while True:
+            data, client_address = self._recv()
+            handshake_msg = self._decode_hello(data)
+            if handshake_msg is not None:
+                break
+            self._process_state(data, client_address)
         
         # Send control mode if provided
-        if control_mode:
-            self.control_mode = control_mode
-            handshake_response = json.dumps({'type': 'handshake', 'control_mode': control_mode})
-            self.sock.sendto(handshake_response.encode(), self.client_address)
+        handshake_response = self._negotiate(handshake_msg, client_address, control_mode)
+        if handshake_response is not None:
+            self.transport.send(handshake_response, client_address)
             if self.verbose:
                 print(f"Sent control mode to client: {control_mode}")
         
-        return self.client_address, handshake_msg
+        return client_address, handshake_msg
     
-    def send_command(self, control_mode, command_values, client_addr=None):
+    def send_command(self, control_mode, command_values, client_addr=None, execute_at=None):
         """Send command to client via UDP based on control mode.
         
         Args:
             control_mode: Type of command ('joint_position', 'ee_position', etc.)
             command_values: List of command values
-            client_addr: Client address (optional, uses stored address if None)
-        """
-        if client_addr is None:
-            client_addr = self.client_address
-        
-        if client_addr is None:
-            raise ValueError("No client address available. Complete handshake first.")
-        
-        if control_mode == 'joint_position':
-            message = json.dumps({'type': 'joint_position', 'data': command_values})
-        elif control_mode == 'ee_position':
-            message = json.dumps({'type': 'ee_position', 'data': command_values})
-        elif control_mode == 'joint_velocity':
-            message = json.dumps({'type': 'joint_velocity', 'data': command_values})
-        elif control_mode == 'ee_velocity':
-            message = json.dumps({'type': 'ee_velocity', 'data': command_values})
-        elif control_mode == 'joint_torque':
-            message = json.dumps({'type': 'joint_torque', 'data': command_values})
-        elif control_mode == 'ee_force':
-            message = json.dumps({'type': 'ee_force', 'data': command_values})
-        else:
-            raise ValueError(f"Unknown control mode: {control_mode}")
+            client_addr: Client address or robot ID (optional, uses most recent client if None)
+            execute_at: protocol.sync_clock() time at which the client should apply
+                the command (optional, applied on receipt if None)
+        """
+        session = self.get_session(client_addr)
+        message = self._encode_command(control_mode, command_values, session, execute_at)
+        self.transport.send(message, session.client_address)
+    
+    def stream_commands(self, control_mode, commands, rate=None, receive_states=True,
+                        skip_late=False, robot=None, start_at=None):
+        """Stream commands at a fixed rate using absolute deadlines.
         
-        if self.verbose:
-            print(f"Sent {control_mode}: {command_values}")
+        Command i is due at start + i / rate, so time spent sending or handling
+        states never accumulates into drift: after an overrun the next wait is
+        simply shorter. While waiting for a deadline, incoming robot states are
+        processed.
+        
+        Args:
+            control_mode: Type of command ('joint_position', 'ee_position', etc.)
+            commands: Sequence of command value lists, or an (N, D) array
+            rate: Command rate in Hz (default: negotiated or configured command_rate)
+            receive_states: Process robot states while waiting (default: True;
+                not needed while the background receiver is running)
+            skip_late: Drop commands whose deadline passed more than a full
+                period ago instead of sending them late (default: False).
+                The final command is always sent.
+            robot: Client address or robot ID (default: most recent client)
+            start_at: protocol.sync_clock() time at which the client should execute
+                the first command; command i then executes at start_at + i / rate
+                (default: execute each command on receipt)
+                
+        Returns:
+            dict: Timing report with commands sent/skipped, missed deadlines and
+                lateness/jitter statistics (seconds)
+        """
+        session = self.get_session(robot)
+        rate = self._stream_rate(rate, session)
+        ticks = [[(session, command)] for command in commands]
+        return self._run_schedule(control_mode, ticks, rate, receive_states, skip_late, start_at)
+    
+    def stream_synchronized(self, control_mode, trajectories, rate=None, lead_time=0.5,
+                            receive_states=True):
+        """Stream trajectories to several robots so they execute in lockstep.
+        
+        Every command carries an execute-at time: all robots apply their first
+        command lead_time seconds from now and command i at that instant plus
+        i / rate, regardless of per-link network latency. Commands are sent on
+        the same fixed-rate schedule, lead_time ahead of their execution.
+        
+        Args:
+            control_mode: Type of command ('joint_position', 'ee_position', etc.)
+            trajectories: Dict mapping client address or robot ID to a sequence of
+                command value lists
+            rate: Command rate in Hz (default: negotiated or configured command_rate
+                of the first robot)
+            lead_time: Seconds between sending and executing each command; must
+                exceed the one-way latency of every link (default: 0.5)
+            receive_states: Process robot states while waiting (default: True)
+            
+        Returns:
+            dict: Timing report as returned by stream_commands, with 'start_at'
+        """
+        sessions, ticks = self._synchronized_ticks(trajectories)
+        rate = self._stream_rate(rate, sessions[0])
+        start_at = protocol.sync_clock() + lead_time
+        report = self._run_schedule(control_mode, ticks, rate, receive_states, False, start_at)
+        report['start_at'] = start_at
+        return report
+    
+    def stream_trajectory(self, control_mode, commands, rate=None, lead_time=0.2, robot=None,
+                          chunk_size=None, receive_states=True):
+        """Send a trajectory as chunks of timestamped waypoints.
+        
+        Instead of one datagram per command, each datagram carries as many
+        waypoints as fit in one MTU-sized datagram, each with its execute-at time.
+        The client buffers them and applies waypoint i at start_at + i / rate,
+        so the per-datagram overhead and the sensitivity to network jitter are
+        paid once per chunk rather than once per command. Each chunk is sent
+        lead_time before its first waypoint is due.
+        
+        Args:
+            control_mode: Type of command ('joint_position', 'ee_position', etc.)
+            commands: Sequence of command value lists, or an (N, D) array
+            rate: Waypoint rate in Hz (default: negotiated or configured command_rate)
+            lead_time: Seconds between sending a chunk and executing its first
+                waypoint; must exceed the one-way latency (default: 0.2)
+            robot: Client address or robot ID (default: most recent client)
+            chunk_size: Waypoints per chunk (default: as many as fit in one datagram)
+            receive_states: Process robot states while waiting (default: True)
+            
+        Returns:
+            dict: Report with 'start_at', 'chunks', 'chunk_size' and 'waypoints' sent
+        """
+        session = self.get_session(robot)
+        rate = self._stream_rate(rate, session)
+        if len(commands) == 0:
+            raise ValueError("Cannot stream an empty trajectory")
+        offsets = np.arange(len(commands)) / rate
+        return self._send_chunks(control_mode, commands, offsets, lead_time, session,
+                                 chunk_size, receive_states)
+    
+    def play_trajectory(self, control_mode, commands, times, lead_time=0.2, robot=None,
+                        chunk_size=None, receive_states=True):
+        """Play back timed waypoints at their own timing.
+        
+        Sends the waypoints as trajectory chunks like stream_trajectory, but
+        waypoint i executes at start_at + (times[i] - times[0]) instead of on a
+        fixed rate, so trajectories recorded at any rate (or with irregular
+        timing) replay at their native timing.
+        
+        Args:
+            control_mode: Type of command ('joint_position', 'ee_position', etc.)
+            commands: Sequence of command value lists, or an (N, D) array
+            times: Time of each waypoint in seconds, non-decreasing (e.g. the
+                time column of a command file)
+            lead_time: Seconds between sending a chunk and executing its first
+                waypoint; must exceed the one-way latency (default: 0.2)
+            robot: Client address or robot ID (default: most recent client)
+            chunk_size: Waypoints per chunk (default: as many as fit in one datagram)
+            receive_states: Process robot states while waiting (default: True)
+            
+        Returns:
+            dict: Report with 'start_at', 'chunks', 'chunk_size' and 'waypoints' sent
+        """
+        session = self.get_session(robot)
+        if len(commands) == 0:
+            raise ValueError("Cannot play an empty trajectory")
+        times = np.asarray(times, dtype=float)
+        if times.shape != (len(commands),):
+            raise ValueError(f"Got {len(times)} times for {len(commands)} waypoints")
+        return self._send_chunks(control_mode, commands, times - times[0], lead_time, session,
+                                 chunk_size, receive_states)
+    
+    def stream_commands_file(self, filename, rate=None, lead_time=0.2, robot=None,
+                             chunk_size=None, receive_states=True):
+        """Stream a command file as trajectory chunks while reading it.
+        
+        Like read_commands_file followed by stream_trajectory, or by
+        play_trajectory if the file has a time column, but the file is parsed
+        one chunk ahead of sending (see trajectory_file.CommandFileReader), so
+        streaming starts within milliseconds and memory use stays constant
+        however large the file. Compressed (.gz, .xz) and binary (.npz) files
+        are accepted, and so are files mixing waypoint lengths (a chunk ends
+        where the length changes).
+        
+        Args:
+            filename: Path to the command file
+            rate: Waypoint rate in Hz, for files without a time column
+                (default: negotiated or configured command_rate)
+            lead_time: Seconds between sending a chunk and executing its first
+                waypoint; must exceed the one-way latency (default: 0.2)
+            robot: Client address or robot ID (default: most recent client)
+            chunk_size: Waypoints per chunk (default: as many as fit in one datagram)
+            receive_states: Process robot states while waiting (default: True)
+            
+        Returns:
+            dict: Report as returned by stream_trajectory, with the file's 'control_mode'
+        """
+        session = self.get_session(robot)
+        with trajectory_file.CommandFileReader(filename) as reader:
+            if reader.dim is None:
+                raise ValueError("Cannot stream an empty trajectory")
+            read_size = self._chunk_size(reader.dim, session, chunk_size)
+            period = None if reader.timed else 1.0 / self._stream_rate(rate, session)
+            # Waypoints longer than the first ones may need smaller chunks
+            chunks = (chunk for values, offsets in
+                      self._file_chunks(reader.chunks(read_size), period)
+                      for chunk in self._timed_chunks(values, offsets, session, chunk_size))
+            report = self._send_chunk_stream(reader.control_mode, chunks, read_size, lead_time,
+                                             session, receive_states)
+        report['control_mode'] = reader.control_mode
+        return report
+    
+    @staticmethod
+    def _file_chunks(chunks, period=None):
+        """Give the waypoints of (values, times) chunks offsets from the first waypoint.
         
-        self.sock.sendto(message.encode(), client_addr)
+        Offsets follow the times, or are period seconds apart if period is given.
+        """
+        first = 0
+        t0 = None
+        for values, times in chunks:
+            if period is not None:
+                yield values, (first + np.arange(len(values))) * period
+            else:
+                if t0 is None:
+                    t0 = times[0]
+                yield values, times - t0
+            first += len(values)
+    
+    def _send_chunks(self, control_mode, commands, offsets, lead_time, session, chunk_size,
+                     receive_states):
+        """Send waypoints executing offsets[i] seconds after the first as trajectory chunks.
+        
+        Returns:
+            dict: Report (see stream_trajectory)
+        """
+        chunks, reported_size = self._trajectory_chunks(commands, offsets, session, chunk_size)
+        return self._send_chunk_stream(control_mode, chunks, reported_size, lead_time, session,
+                                       receive_states)
+    
+    def _send_chunk_stream(self, control_mode, chunks, chunk_size, lead_time, session,
+                           receive_states):
+        """Send (waypoints, offsets) chunks, each lead_time before its first waypoint is due.
+        
+        Waypoint offsets are seconds after the first waypoint of the stream.
+        
+        Returns:
+            dict: Report (see stream_trajectory)
+        """
+        start = time.monotonic()
+        start_at = protocol.sync_clock() + lead_time
+        count = 0
+        sent = 0
+        
+        for offset, message, waypoints in self._chunk_messages(control_mode, chunks, start_at,
+                                                               session):
+            self._wait_until(start + offset, receive_states)
+            self.transport.send(message, session.client_address)
+            count += 1
+            sent += waypoints
+        
+        return {'start_at': start_at, 'chunks': count, 'chunk_size': chunk_size,
+                'waypoints': sent, 'duration': time.monotonic() - start}
+    
+    def _run_schedule(self, control_mode, ticks, rate, receive_states, skip_late, start_at):
+        """Send each tick's (session, command) pairs on absolute deadlines.
+        
+        Returns:
+            dict: Timing report (see stream_commands)
+        """
+        period = 1.0 / rate
+        lateness = protocol.RunningStats()
+        sent = 0
+        skipped = 0
+        missed = 0
+        last_index = len(ticks) - 1
+        start = time.monotonic()
+        
+        for i, tick in enumerate(ticks):
+            deadline = start + i * period
+            self._wait_until(deadline, receive_states)
+            
+            late = time.monotonic() - deadline
+            if skip_late and late >= period and i < last_index:
+                skipped += len(tick)
+                missed += 1
+                continue
+            
+            execute_at = None if start_at is None else start_at + i * period
+            for session, command in tick:
+                self.send_command(control_mode, command, session.client_address, execute_at)
+            sent += len(tick)
+            lateness.add(late)
+            if late > self.MISS_TOLERANCE * period:
+                missed += 1
+        
+        total = sum(len(tick) for tick in ticks)
+        return self._stream_report(rate, total, sent, skipped, missed, lateness, start)
+    
+    def _wait_until(self, deadline, receive_states=True):
+        """Wait until a time.monotonic() deadline, handling robot states meanwhile.
+        
+        Blocks on the transport (or sleeps) for most of the wait and busy-waits
+        for the last SPIN_THRESHOLD seconds for sub-millisecond accuracy.
+        """
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if receive_states and not self._receiver_running and remaining > self.POLL_MARGIN:
+                self._poll_state(remaining - self.POLL_MARGIN)
+            elif remaining > self.SPIN_THRESHOLD:
+                time.sleep(remaining - self.SPIN_THRESHOLD)
+    
+    def _recv(self, timeout=None):
+        """Receive one message into the reused receive buffer.
+        
+        Args:
+            timeout: Seconds to wait (default: None, wait forever)
+        
+        Returns:
+            tuple: (memoryview of the message, valid until the next receive,
+                address), or (None, None) if no message arrived within timeout
+        """
+        received = self.transport.recv(self._recv_buffer, timeout)
+        if received is None:
+            return None, None
+        nbytes, addr = received
+        return self._recv_view[:nbytes], addr
+    
+    def _poll_state(self, timeout):
+        """Process one robot state message if it arrives within timeout (no warning on timeout)."""
+        data, addr = self._recv(timeout)
+        if data is None:
+            return None
+        return self._process_state(data, addr)
     
-    def receive_state(self, timeout=5.0):
+    def receive_state(self, timeout=5.0, robot=None):
         """Receive and process robot states from client.
         
+        States from other robots that arrive meanwhile are stored as well.
+        
         Args:
-            timeout: Socket timeout in seconds (default: 5.0)
+            timeout: Receive timeout in seconds (default: 5.0)
+            robot: Client address or robot ID (default: most recent client)
             
         Returns:
             dict: Robot states dictionary or None if timeout
         """
-        self.sock.settimeout(timeout)
+        session = self.get_session(robot)
+        deadline = time.monotonic() + timeout
         
-        try:
-            data, addr = self.sock.recvfrom(4096)  # Larger buffer for state data
+        if self._receiver_running:
+            # The background receiver owns the transport, wait for it to store a new state
+            with self._state_condition:
+                count = session.state_count
+                if self._state_condition.wait_for(lambda: session.state_count != count, timeout):
+                    return session.robot_states
+        else:
+            while True:
+                data, addr = self._recv(max(deadline - time.monotonic(), 0.0))
+                if data is None:
+                    break
+                if self._process_state(data, addr) is session:
+                    return session.robot_states
+        
+        if self.verbose:
+            print("Warning: No response from client (timeout)")
+        return None
+    
+    def ping_clock(self, robot=None):
+        """Send one clock synchronization ping; the reply is processed with the states.
+        
+        Args:
+            robot: Client address or robot ID (default: most recent client)
+        """
+        session = self.get_session(robot)
+        self.transport.send(self._clock_ping(session), session.client_address)
+    
+    def synchronize_clock(self, robot=None, samples=8, interval=0.01):
+        """Estimate the clock offset to a robot client with a burst of pings.
+        
+        Args:
+            robot: Client address or robot ID (default: most recent client)
+            samples: Number of ping/pong exchanges (default: 8)
+            interval: Seconds to wait for each reply before the next ping (default: 0.01)
+            
+        Returns:
+            dict: Clock synchronization estimate (see get_clock_sync)
+        """
+        session = self.get_session(robot)
+        for _ in range(samples):
+            count = session.clock.count
+            deadline = time.monotonic() + interval
+            self.ping_clock(session.client_address)
             
+            if self._receiver_running:
+                with self._state_condition:
+                    self._state_condition.wait_for(lambda: session.clock.count != count, interval)
+            else:
+                while session.clock.count == count and time.monotonic() < deadline:
+                    self._poll_state(deadline - time.monotonic())
+        
+        if self.verbose:
+            print(f"Clock sync with {session.name}: {session.clock.as_dict()}")
+        return session.clock.as_dict()
+    
+    def start_receiver(self, clock_sync_interval=None):
+        """Start a background thread that continuously receives robot states.
+        
+        Incoming states are stored in robot_states and state_history as they
+        arrive, so sending commands never waits on feedback. Start it after the
+        handshake; while it runs, receive_state waits for the thread instead of
+        reading the transport.
+        
+        Args:
+            clock_sync_interval: Seconds between clock synchronization pings to
+                every connected robot (default: no periodic pings)
+        """
+        if self._receiver_running:
+            return
+        self._clock_sync_interval = clock_sync_interval
+        self._receiver_running = True
+        self._receiver_thread = threading.Thread(target=self._receive_loop, daemon=True)
+        self._receiver_thread.start()
+        if self.verbose:
+            print("Background state receiver started")
+    
+    def stop_receiver(self):
+        """Stop the background state receiver thread."""
+        if not self._receiver_running:
+            return
+        self._receiver_running = False
+        self._receiver_thread.join()
+        self._receiver_thread = None
+        if self.verbose:
+            print("Background state receiver stopped")
+    
+    def _receive_loop(self):
+        """Drain robot state messages until stop_receiver is called."""
+        next_ping = time.monotonic()
+        try:
+            while self._receiver_running:
+                if self._clock_sync_interval is not None and time.monotonic() >= next_ping:
+                    next_ping += self._clock_sync_interval
+                    self._ping_sessions()
+                try:
+                    data, addr = self._recv(self.RECEIVER_POLL_INTERVAL)
+                except OSError:
+                    # Transport closed
+                    break
+                if data is not None:
+                    self._process_state(data, addr)
+        finally:
+            # Lets receive_state read the transport itself again if the thread ends
+            self._receiver_running = False
+    
+    def _ping_sessions(self):
+        """Send a clock synchronization ping to every session that supports it.
+        
+        A session whose client is gone (e.g. a closed TCP connection) is
+        skipped, so it cannot stop the receiver thread.
+        """
+        for session in self._clock_sync_sessions():
             try:
-                message = json.loads(data.decode())
-                
-                if message.get('type') == 'robot_states':
-                    self.robot_states = message['data']
-                    
-                    if self.verbose:
-                        # Print received states in readable format
-                        print("\n=== Received Robot States ===")
-                        print(f"Joint Positions: {self.robot_states['joint_positions']}")
-                        print(f"Joint Velocities: {self.robot_states['joint_velocities']}")
-                        print(f"Joint Efforts (Torques): {self.robot_states['joint_efforts']}")
-                        print(f"End Effector Pose: {self.robot_states['ee_pose']}")
-                        print(f"End Effector Position: {self.robot_states['ee_position']}")
-                        print(f"End Effector Orientation (Rotation Matrix):")
-                        for row in self.robot_states['ee_orientation']:
-                            print(f"  {row}")
-                        print("============================\n")
-                    
-                    return self.robot_states
-                else:
-                    if self.verbose:
-                        print(f"Received unexpected message type: {message.get('type')}")
-                    return None
-                    
-            except Exception as e:
-                print(f"Error processing robot states: {e}")
-                return None
+                self.transport.send(self._clock_ping(session), session.client_address)
+            except OSError as e:
+                if self.verbose:
+                    print(f"Clock sync ping to {session.name} failed: {e}")
+    
+    def close(self):
+        """Stop the background receiver and close the server transport."""
+        self.stop_receiver()
+        self.transport.close()
+        if self.verbose:
+            print("Server transport closed")
+
+
+class _ServerDatagramProtocol(asyncio.DatagramProtocol):
+    """asyncio protocol forwarding received datagrams to an AsyncRobotCommandServer."""
+    
+    def __init__(self, server):
+        self.server = server
+    
+    def datagram_received(self, data, addr):
+        self.server._datagram_received(data, addr)
+    
+    def error_received(self, exc):
+        if self.server.verbose:
+            print(f"Socket error: {exc}")
+
+
+class AsyncRobotCommandServer(BaseRobotCommandServer):
+    """asyncio variant of RobotCommandServer for embedding in async applications.
+    
+    Uses loop.create_datagram_endpoint, so no thread or blocking socket call is
+    needed per robot:
+    
+        async with AsyncRobotCommandServer(server_port=5000) as server:
+            await server.wait_for_handshake('joint_position')
+            await server.send_command('joint_position', command)
+            async for robot_states in server.states():
+                ...
+    """
+    
+    # Remaining wait (s) below which the scheduler yields instead of sleeping
+    # (the event loop wakes up with millisecond resolution)
+    SPIN_THRESHOLD = 0.0015
+    
+    def __init__(self, server_host='0.0.0.0', server_port=5000, verbose=True,
+                 state_queue_size=100, **kwargs):
+        """Initialize the async robot command server (call start() or use async with).
+        
+        Args:
+            server_host: Host address to bind the server socket (default: '0.0.0.0')
+            server_port: Port number for the server socket (default: 5000)
+            verbose: Enable verbose output (default: True)
+            state_queue_size: States buffered per states() iterator before the
+                oldest are dropped (default: 100)
+            **kwargs: Protocol settings, see BaseRobotCommandServer
+        """
+        super().__init__(server_host, server_port, verbose, **kwargs)
+        self.state_queue_size = state_queue_size
+        self.transport = None
+        
+        # Future resolved by the next datagram while waiting for a handshake
+        self._handshake = None
+        # (session, queue) of active states() iterators and receive_state() calls
+        self._subscribers = []
+        # Periodic clock synchronization (see start_clock_sync)
+        self._clock_sync_task = None
+    
+    async def start(self):
+        """Bind the UDP endpoint on the running event loop."""
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: _ServerDatagramProtocol(self),
+            local_addr=(self.server_host, self.server_port))
+        if self.verbose:
+            print(f"Server listening on {self.server_host}:{self.server_port}")
+    
+    async def __aenter__(self):
+        await self.start()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+    
+    async def wait_for_handshake(self, control_mode=None, timeout=None):
+        """Wait for client connection and complete handshake.
+        
+        Args:
+            control_mode: Control mode to send to client (optional, can be set later)
+            timeout: Seconds to wait for the client (default: wait forever)
+            
+        Returns:
+            tuple: (client_address, handshake_message)
+        """
+        if self.verbose:
+            print("Waiting for client connection...")
+        
+        self._handshake = asyncio.get_running_loop().create_future()
+        try:
+            handshake_msg, client_address = await asyncio.wait_for(self._handshake, timeout)
+        finally:
+            self._handshake = None
+        
+        # Send control mode if provided
+        handshake_response = self._negotiate(handshake_msg, client_address, control_mode)
+        if handshake_response is not None:
+            self.transport.sendto(handshake_response, client_address)
+            if self.verbose:
+                print(f"Sent control mode to client: {control_mode}")
+        
+        return client_address, handshake_msg
+    
+    async def send_command(self, control_mode, command_values, client_addr=None, execute_at=None):
+        """Send command to client via UDP based on control mode.
+        
+        Args:
+            control_mode: Type of command ('joint_position', 'ee_position', etc.)
+            command_values: List of command values
+            client_addr: Client address or robot ID (optional, uses most recent client if None)
+            execute_at: protocol.sync_clock() time at which the client should apply
+                the command (optional, applied on receipt if None)
+        """
+        session = self.get_session(client_addr)
+        message = self._encode_command(control_mode, command_values, session, execute_at)
+        self.transport.sendto(message, session.client_address)
+    
+    async def stream_commands(self, control_mode, commands, rate=None, skip_late=False,
+                              robot=None, start_at=None):
+        """Stream commands at a fixed rate using absolute deadlines.
+        
+        Same schedule and report as RobotCommandServer.stream_commands, but waits
+        with asyncio.sleep so other tasks keep running. The event loop only wakes
+        up with millisecond resolution, so the last SPIN_THRESHOLD seconds before
+        a deadline are spent yielding to the loop with asyncio.sleep(0).
+        
+        Args:
+            control_mode: Type of command ('joint_position', 'ee_position', etc.)
+            commands: Sequence of command value lists, or an (N, D) array
+            rate: Command rate in Hz (default: negotiated or configured command_rate)
+            skip_late: Drop commands whose deadline passed more than a full
+                period ago instead of sending them late (default: False)
+            robot: Client address or robot ID (default: most recent client)
+            start_at: protocol.sync_clock() time at which the client should execute
+                the first command; command i then executes at start_at + i / rate
+                (default: execute each command on receipt)
                 
-        except socket.timeout:
+        Returns:
+            dict: Timing report with commands sent/skipped, missed deadlines and
+                lateness/jitter statistics (seconds)
+        """
+        session = self.get_session(robot)
+        rate = self._stream_rate(rate, session)
+        ticks = [[(session, command)] for command in commands]
+        return await self._run_schedule(control_mode, ticks, rate, skip_late, start_at)
+    
+    async def stream_synchronized(self, control_mode, trajectories, rate=None, lead_time=0.5):
+        """Stream trajectories to several robots so they execute in lockstep.
+        
+        See RobotCommandServer.stream_synchronized.
+        
+        Args:
+            control_mode: Type of command ('joint_position', 'ee_position', etc.)
+            trajectories: Dict mapping client address or robot ID to a sequence of
+                command value lists
+            rate: Command rate in Hz (default: negotiated or configured command_rate
+                of the first robot)
+            lead_time: Seconds between sending and executing each command (default: 0.5)
+            
+        Returns:
+            dict: Timing report as returned by stream_commands, with 'start_at'
+        """
+        sessions, ticks = self._synchronized_ticks(trajectories)
+        rate = self._stream_rate(rate, sessions[0])
+        start_at = protocol.sync_clock() + lead_time
+        report = await self._run_schedule(control_mode, ticks, rate, False, start_at)
+        report['start_at'] = start_at
+        return report
+    
+    async def stream_trajectory(self, control_mode, commands, rate=None, lead_time=0.2, robot=None,
+                                chunk_size=None):
+        """Send a trajectory as chunks of timestamped waypoints.
+        
+        See RobotCommandServer.stream_trajectory.
+        
+        Args:
+            control_mode: Type of command ('joint_position', 'ee_position', etc.)
+            commands: Sequence of command value lists, or an (N, D) array
+            rate: Waypoint rate in Hz (default: negotiated or configured command_rate)
+            lead_time: Seconds between sending a chunk and executing its first
+                waypoint (default: 0.2)
+            robot: Client address or robot ID (default: most recent client)
+            chunk_size: Waypoints per chunk (default: as many as fit in one datagram)
+            
+        Returns:
+            dict: Report with 'start_at', 'chunks', 'chunk_size' and 'waypoints' sent
+        """
+        session = self.get_session(robot)
+        rate = self._stream_rate(rate, session)
+        if len(commands) == 0:
+            raise ValueError("Cannot stream an empty trajectory")
+        offsets = np.arange(len(commands)) / rate
+        chunks, chunk_size = self._trajectory_chunks(commands, offsets, session, chunk_size)
+        return await self._send_chunk_stream(control_mode, chunks, chunk_size, lead_time, session)
+    
+    async def _send_chunk_stream(self, control_mode, chunks, chunk_size, lead_time, session):
+        """Send (waypoints, offsets) chunks, each lead_time before its first waypoint is due.
+        
+        See RobotCommandServer._send_chunk_stream.
+        
+        Returns:
+            dict: Report (see stream_trajectory)
+        """
+        start = time.monotonic()
+        start_at = protocol.sync_clock() + lead_time
+        count = 0
+        sent = 0
+        
+        for offset, message, waypoints in self._chunk_messages(control_mode, chunks, start_at,
+                                                               session):
+            await self._wait_until(start + offset)
+            self.transport.sendto(message, session.client_address)
+            count += 1
+            sent += waypoints
+        
+        return {'start_at': start_at, 'chunks': count, 'chunk_size': chunk_size,
+                'waypoints': sent, 'duration': time.monotonic() - start}
+    
+    async def _run_schedule(self, control_mode, ticks, rate, skip_late, start_at):
+        """Send each tick's (session, command) pairs on absolute deadlines.
+        
+        Returns:
+            dict: Timing report (see stream_commands)
+        """
+        period = 1.0 / rate
+        lateness = protocol.RunningStats()
+        sent = 0
+        skipped = 0
+        missed = 0
+        last_index = len(ticks) - 1
+        start = time.monotonic()
+        
+        for i, tick in enumerate(ticks):
+            deadline = start + i * period
+            await self._wait_until(deadline)
+            
+            late = time.monotonic() - deadline
+            if skip_late and late >= period and i < last_index:
+                skipped += len(tick)
+                missed += 1
+                continue
+            
+            execute_at = None if start_at is None else start_at + i * period
+            for session, command in tick:
+                await self.send_command(control_mode, command, session.client_address, execute_at)
+            sent += len(tick)
+            lateness.add(late)
+            if late > self.MISS_TOLERANCE * period:
+                missed += 1
+        
+        total = sum(len(tick) for tick in ticks)
+        return self._stream_report(rate, total, sent, skipped, missed, lateness, start)
+    
+    async def ping_clock(self, robot=None):
+        """Send one clock synchronization ping; the reply is processed with the states.
+        
+        Args:
+            robot: Client address or robot ID (default: most recent client)
+        """
+        session = self.get_session(robot)
+        self.transport.sendto(self._clock_ping(session), session.client_address)
+    
+    async def synchronize_clock(self, robot=None, samples=8, interval=0.01):
+        """Estimate the clock offset to a robot client with a burst of pings.
+        
+        Args:
+            robot: Client address or robot ID (default: most recent client)
+            samples: Number of ping/pong exchanges (default: 8)
+            interval: Seconds between pings (default: 0.01)
+            
+        Returns:
+            dict: Clock synchronization estimate (see get_clock_sync)
+        """
+        session = self.get_session(robot)
+        for _ in range(samples):
+            await self.ping_clock(session.client_address)
+            await asyncio.sleep(interval)
+        return session.clock.as_dict()
+    
+    def start_clock_sync(self, interval=1.0):
+        """Ping every connected robot periodically to keep clock estimates current.
+        
+        Args:
+            interval: Seconds between pings (default: 1.0)
+            
+        Returns:
+            asyncio.Task: The ping task (cancelled by close())
+        """
+        async def ping_periodically():
+            while True:
+                for session in self._clock_sync_sessions():
+                    await self.ping_clock(session.client_address)
+                await asyncio.sleep(interval)
+        
+        self._clock_sync_task = asyncio.get_running_loop().create_task(ping_periodically())
+        return self._clock_sync_task
+    
+    async def _wait_until(self, deadline):
+        """Wait until a time.monotonic() deadline without blocking the event loop."""
+        remaining = deadline - time.monotonic()
+        if remaining > self.SPIN_THRESHOLD:
+            await asyncio.sleep(remaining - self.SPIN_THRESHOLD)
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0)
+    
+    async def receive_state(self, timeout=5.0, robot=None):
+        """Wait for the next robot state from the client.
+        
+        Args:
+            timeout: Seconds to wait (default: 5.0)
+            robot: Client address or robot ID (default: most recent client)
+            
+        Returns:
+            dict: Robot states dictionary or None if timeout
+        """
+        subscriber = self._subscribe(robot, 1)
+        try:
+            return await asyncio.wait_for(subscriber[1].get(), timeout)
+        except asyncio.TimeoutError:
             if self.verbose:
                 print("Warning: No response from client (timeout)")
             return None
+        finally:
+            self._subscribers.remove(subscriber)
     
-    def get_latest_state(self):
-        """Get the most recently received robot state.
+    async def states(self, robot=None):
+        """Asynchronously iterate over robot states as they arrive.
         
-        Returns:
-            dict: Latest robot states dictionary
+        Args:
+            robot: Client address or robot ID (default: most recent client)
+            
+        Yields:
+            dict: Each new (non-stale) robot states dictionary
         """
-        return self.robot_states
+        subscriber = self._subscribe(robot, self.state_queue_size)
+        try:
+            while True:
+                yield await subscriber[1].get()
+        finally:
+            self._subscribers.remove(subscriber)
+    
+    def _subscribe(self, robot, maxsize):
+        """Register a queue that receives every new state of a robot."""
+        subscriber = (self.get_session(robot), asyncio.Queue(maxsize))
+        self._subscribers.append(subscriber)
+        return subscriber
+    
+    def _send(self, message, client_address):
+        self.transport.sendto(message, client_address)
+    
+    def _datagram_received(self, data, addr):
+        """Handle a datagram delivered by the event loop."""
+        if self._handshake is not None and not self._handshake.done():
+            handshake_msg = self._decode_hello(data)
+            if handshake_msg is not None:
+                self._handshake.set_result((handshake_msg, addr))
+                return
+        
+        session = self._process_state(data, addr)
+        if session is None:
+            return
+        for subscribed, queue in self._subscribers:
+            if subscribed is not session:
+                continue
+            # Drop the oldest state for consumers that fall behind
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(session.robot_states)
     
     def close(self):
-        """Close the server socket."""
-        self.sock.close()
-        if self.verbose:
-            print("Server socket closed")
+        """Stop periodic clock synchronization and close the UDP endpoint."""
+        if self._clock_sync_task is not None:
+            self._clock_sync_task.cancel()
+            self._clock_sync_task = None
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+            if self.verbose:
+                print("Server socket closed")
 
 
 # Main loop (for backward compatibility)
@@ -209,21 +1604,28 @@ def main():
     server = RobotCommandServer(server_host='0.0.0.0', server_port=5000, verbose=True)
     
     try:
-        # Read control mode and commands from file
-        control_mode, commands = server.read_commands_file(commands_file)
+        # Read control mode, commands and their optional time column from file
+        control_mode, commands, times = trajectory_file.read_commands(commands_file)
         print(f"Control mode: {control_mode}")
         print(f"Loaded {len(commands)} commands from file")
         
         # Wait for client handshake
         server.wait_for_handshake(control_mode)
         
-        # Send commands one by one
-        for command in commands:
-            server.send_command(control_mode, command)
-            time.sleep(2.0)  # Wait between commands
-            
-            # Receive robot states from client
-            server.receive_state(timeout=5.0)
+        # Receive robot states in the background from now on
+        server.start_receiver()
+        
+        if times is None:
+            # No time column: send commands at a fixed rate, one every 2 seconds
+            server.stream_commands(control_mode, commands, rate=0.5)
+        else:
+            # Replay the waypoints at the file's timing, then wait for the last one
+            report = server.play_trajectory(control_mode, commands, times)
+            end = report['start_at'] + times[-1] - times[0]
+            time.sleep(max(end - protocol.sync_clock(), 0.0))
+        
+        # Wait for robot states for the last command
+        server.receive_state(timeout=5.0)
         
         print("All commands sent successfully")
         
@@ -0,0 +1,229 @@
+"""Shared-memory transport for a server and client on the same host.
+
+Messages are the same datagrams the UDP transport carries (see protocol.py),
+written into rings of seqlock-protected slots in multiprocessing.shared_memory
+segments instead of going through the network stack:
+- '<name>_cmd': commands and handshake responses, server -> client
+- '<name>_state': handshakes and robot states, client -> server
+
+SharedMemoryTransport implements transport.Transport, so the server and
+client can use it in place of their UDP socket.
+"""
+import os
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+from transport import Transport
+
+# Slots per direction; with one command slot only the latest command is kept
+COMMAND_SLOTS = 64
+STATE_SLOTS = 256
+
+# Segment layout: ring geometry, number of messages written, then slots of a
+# seqlock counter and message length followed by the payload
+META = struct.Struct('<II')
+HEAD = struct.Struct('<Q')
+SLOT_HEADER = struct.Struct('<QI4x')
+SEQ = struct.Struct('<Q')
+
+# Names of the segments this process created (and registered with its tracker)
+_created_segments = set()
+
+
+def _tracker_inherited():
+    """Whether this process shares the resource tracker of its parent process.
+
+    multiprocessing children (forked or spawned) report to the tracker their
+    parent started rather than starting their own.
+    """
+    tracker = resource_tracker._resource_tracker
+    if tracker._fd is None:
+        return False
+    if tracker._pid is None:
+        # Spawned children only get the tracker's pipe
+        return True
+    try:
+        os.waitpid(tracker._pid, os.WNOHANG)
+    except ChildProcessError:
+        # Forked children inherit a tracker that is not their own child
+        return True
+    return False
+
+
+class SharedMemoryChannel:
+    """Single-writer ring of message slots in a shared memory segment.
+
+    The segment holds the number of messages written so far, followed by the
+    slots. Message k goes to slot k % slots, whose seqlock counter is odd
+    (2k + 1) while it is being written and 2k + 2 once complete. Readers copy
+    the payload and check the counter did not change meanwhile, so they never
+    block the writer and never see a torn message. Readers that fall more than
+    a ring behind skip the overwritten messages and count them as overruns.
+    """
+
+    def __init__(self, name, slots=None, slot_size=None, create=False):
+        """Create or attach to a channel.
+
+        Args:
+            name: Shared memory segment name
+            slots: Number of message slots (when creating)
+            slot_size: Largest message in bytes (when creating)
+            create: Create the segment (writer side) rather than attach to it;
+                attaching reads slots and slot_size from the segment
+        """
+        if create:
+            size = META.size + HEAD.size + slots * (SLOT_HEADER.size + slot_size)
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            except FileExistsError:
+                # Left behind by a server that did not shut down cleanly
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            _created_segments.add(self.shm._name)
+            self.shm.buf[:size] = bytes(size)
+            META.pack_into(self.shm.buf, 0, slots, slot_size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # Attaching registers the segment with this process's resource
+            # tracker, which would remove it when this process exits. A tracker
+            # shared with the creator holds a single registration of the name,
+            # which must stay for the creator's unlink
+            if self.shm._name not in _created_segments and not _tracker_inherited():
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+            slots, slot_size = META.unpack_from(self.shm.buf)
+        self.created = create
+        self.slots = slots
+        self.slot_size = slot_size
+        self._stride = SLOT_HEADER.size + slot_size
+        self._buf = self.shm.buf
+        # Readers start with the messages written after they attach
+        self._read = HEAD.unpack_from(self._buf, META.size)[0]
+        self.overruns = 0
+
+    def _slot_offset(self, index):
+        return META.size + HEAD.size + (index % self.slots) * self._stride
+
+    def write(self, data):
+        """Write a message into the next slot.
+
+        Args:
+            data: Message bytes (bytes, bytearray or memoryview)
+        """
+        length = len(data)
+        if length > self.slot_size:
+            raise ValueError(f"Message of {length} bytes exceeds slot size of {self.slot_size} bytes")
+        buf = self._buf
+        index = HEAD.unpack_from(buf, META.size)[0]
+        offset = self._slot_offset(index)
+        SLOT_HEADER.pack_into(buf, offset, 2 * index + 1, length)
+        start = offset + SLOT_HEADER.size
+        buf[start:start + length] = data
+        SEQ.pack_into(buf, offset, 2 * index + 2)
+        HEAD.pack_into(buf, META.size, index + 1)
+
+    def read_into(self, buffer):
+        """Copy the next unread message into buffer.
+
+        Returns:
+            int: Bytes copied (the message length, truncated to the buffer),
+                or None if there is no unread message
+        """
+        buf = self._buf
+        while True:
+            head = HEAD.unpack_from(buf, META.size)[0]
+            if self._read >= head:
+                return None
+            if head - self._read > self.slots:
+                self.overruns += head - self._read - self.slots
+                self._read = head - self.slots
+
+            offset = self._slot_offset(self._read)
+            expected = 2 * self._read + 2
+            seq, length = SLOT_HEADER.unpack_from(buf, offset)
+            if seq == expected:
+                start = offset + SLOT_HEADER.size
+                length = min(length, len(buffer))
+                buffer[:length] = buf[start:start + length]
+                if SEQ.unpack_from(buf, offset)[0] == expected:
+                    self._read += 1
+                    return length
+            # Overwritten before or while reading: the writer lapped us, skip ahead
+            self.overruns += 1
+            self._read += 1
+
+    def close(self):
+        """Detach from the segment, removing it if this side created it."""
+        self._buf.release()
+        self._buf = None
+        self.shm.close()
+        if self.created:
+            self.shm.unlink()
+            _created_segments.discard(self.shm._name)
+
+
+class SharedMemoryTransport(Transport):
+    """Transport over a pair of shared memory channels.
+
+    Receives poll the incoming channel: they busy-wait for the first
+    SPIN_TIME seconds, which keeps handoff latency in the microseconds, and
+    then sleep POLL_INTERVAL between checks. Busy-waiting only pays off when
+    server and client have cores to themselves, so it is off on small machines.
+    """
+
+    SPIN_TIME = 0.0005 if (os.cpu_count() or 1) > 2 else 0.0
+    POLL_INTERVAL = 0.00005
+
+    def __init__(self, name, server=False, max_message_size=4096,
+                 command_slots=COMMAND_SLOTS, state_slots=STATE_SLOTS):
+        """Create (server) or attach to (client) the channels of a link.
+
+        The server must be started first; the client takes the ring sizes from
+        the segments it attaches to.
+
+        Args:
+            name: Link name shared by server and client
+            server: Create the segments and send commands (True) or attach and
+                send states (False, the client) (default: False)
+            max_message_size: Largest message in bytes, when creating (default: 4096)
+            command_slots: Slots of the command channel, when creating (default: COMMAND_SLOTS)
+            state_slots: Slots of the state channel, when creating (default: STATE_SLOTS)
+        """
+        self.name = name
+        self.address = ('shm', name)
+        command = SharedMemoryChannel(f"{name}_cmd", command_slots, max_message_size, create=server)
+        state = SharedMemoryChannel(f"{name}_state", state_slots, max_message_size, create=server)
+        self._outgoing, self._incoming = (command, state) if server else (state, command)
+        # Several threads may send (e.g. states and clock replies); the ring has one writer
+        self._send_lock = threading.Lock()
+
+    def send(self, data, address=None):
+        """Send a message to the peer (address is ignored; there is only one)."""
+        with self._send_lock:
+            self._outgoing.write(data)
+
+    def recv(self, buffer, timeout=None):
+        """Receive the next message into buffer (see Transport.recv)."""
+        start = time.monotonic()
+        while True:
+            length = self._incoming.read_into(buffer)
+            if length is not None:
+                return length, self.address
+            waited = time.monotonic() - start
+            if timeout is not None and waited >= timeout:
+                return None
+            if waited > self.SPIN_TIME:
+                time.sleep(self.POLL_INTERVAL)
+
+    @property
+    def overruns(self):
+        """Incoming messages lost because the reader fell a full ring behind."""
+        return self._incoming.overruns
+
+    def close(self):
+        """Close the link; the server side also removes the segments."""
+        self._outgoing.close()
+        self._incoming.close()
@@ -0,0 +1,155 @@
+"""Fixed-capacity history of robot states for sendcomm.py, backed by NumPy.
+
+States are stored as rows of a structured array, so recent history can be read
+as whole arrays (e.g. all joint positions of the last second) without looping
+over Python dicts.
+"""
+import numpy as np
+
+
+def state_dtype(n_joints=7):
+    """Structured dtype of one stored robot state.
+
+    Fields: timestamp (server time.monotonic() at receipt), seq (-1 if the client
+    sends none), q, dq, tau (joint positions, velocities, efforts), ee_pos and
+    ee_quat (end effector position and (x, y, z, w) quaternion). Values the
+    client did not report are NaN.
+    """
+    return np.dtype([
+        ('timestamp', 'f8'),
+        ('seq', 'i8'),
+        ('q', 'f8', (n_joints,)),
+        ('dq', 'f8', (n_joints,)),
+        ('tau', 'f8', (n_joints,)),
+        ('ee_pos', 'f8', (3,)),
+        ('ee_quat', 'f8', (4,)),
+    ])
+
+
+# Stored field -> robot states key it is filled from
+STATE_KEYS = {
+    'q': 'joint_positions',
+    'dq': 'joint_velocities',
+    'tau': 'joint_efforts',
+    'ee_pos': 'ee_position',
+    'ee_quat': 'ee_orientation',
+}
+
+
+class StateRingBuffer:
+    """Ring buffer of the most recent robot states in a NumPy structured array.
+
+    Queries return rows oldest first. They are views into the buffer when the
+    requested rows are contiguous and a single vectorized copy when they wrap
+    around its end, so callers that keep results while new states arrive should
+    copy them.
+    """
+
+    def __init__(self, capacity=1000, n_joints=7):
+        """Initialize the buffer.
+
+        Args:
+            capacity: Number of states kept (default: 1000)
+            n_joints: Number of joints of the robot (default: 7)
+        """
+        if capacity < 1:
+            raise ValueError(f"Capacity must be at least 1, got {capacity}")
+        self.capacity = capacity
+        self.data = np.zeros(capacity, dtype=state_dtype(n_joints))
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, seq, robot_states):
+        """Store a robot state, overwriting the oldest one when full.
+
+        Args:
+            timestamp: Receive time (time.monotonic())
+            seq: Sequence number of the state message, or None
+            robot_states: Robot states dictionary of numeric arrays; ee_pose
+                ([x, y, z, qx, qy, qz, qw]) fills ee_pos and ee_quat when
+                ee_position and ee_orientation are absent
+        """
+        row = self.data[self._next]
+        row['timestamp'] = timestamp
+        row['seq'] = -1 if seq is None else seq
+        for field, key in STATE_KEYS.items():
+            values = robot_states.get(key)
+            row[field] = np.nan if values is None or len(values) == 0 else values
+
+        ee_pose = robot_states.get('ee_pose')
+        if ee_pose is not None and len(ee_pose) == 7:
+            if robot_states.get('ee_position') is None:
+                row['ee_pos'] = ee_pose[:3]
+            if robot_states.get('ee_orientation') is None:
+                row['ee_quat'] = ee_pose[3:]
+
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def clear(self):
+        """Drop all stored states."""
+        self._next = 0
+        self._count = 0
+
+    def _segments(self):
+        """Stored rows as one or two views, oldest first."""
+        if self._count < self.capacity:
+            return [self.data[:self._count]]
+        return [self.data[self._next:], self.data[:self._next]]
+
+    def last_n(self, n):
+        """The n most recent states, oldest first.
+
+        Returns:
+            np.ndarray: Structured array of at most n rows
+        """
+        n = min(n, self._count)
+        if n <= 0:
+            return self.data[:0]
+        end = self._next if self._next else self.capacity
+        if n <= end:
+            return self.data[end - n:end]
+        return np.concatenate((self.data[self.capacity - (n - end):], self.data[:end]))
+
+    def states_between(self, t0, t1):
+        """States received in the time range [t0, t1], oldest first.
+
+        Args:
+            t0: Start of the range (time.monotonic())
+            t1: End of the range (time.monotonic())
+
+        Returns:
+            np.ndarray: Structured array of the matching rows
+        """
+        parts = []
+        for segment in self._segments():
+            timestamps = segment['timestamp']
+            start = np.searchsorted(timestamps, t0, side='left')
+            stop = np.searchsorted(timestamps, t1, side='right')
+            if stop > start:
+                parts.append(segment[start:stop])
+        if not parts:
+            return self.data[:0]
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts)
+
+    def latest(self):
+        """The most recent state as a structured scalar, or None if empty."""
+        if not self._count:
+            return None
+        return self.data[self._next - 1]
+
+    def as_arrays(self):
+        """All stored states as one array per field, oldest first.
+
+        Returns:
+            dict: Field name -> array of shape (len(self), ...) for every field
+                of state_dtype
+        """
+        segments = self._segments()
+        rows = segments[0] if len(segments) == 1 else np.concatenate(segments)
+        return {field: rows[field] for field in rows.dtype.names}
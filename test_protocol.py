@@ -0,0 +1,84 @@
+"""Tests of the sequence number accounting and state helpers in protocol.py."""
+import numpy as np
+
+import protocol
+from protocol import SequenceTracker
+
+
+def accept_all(tracker, seqs):
+    return [tracker.accept(seq) for seq in seqs]
+
+
+def test_in_order():
+    tracker = SequenceTracker()
+    assert accept_all(tracker, range(1, 11)) == [True] * 10
+    assert tracker.get_counters() == {'received': 10, 'lost': 0, 'reordered': 0,
+                                      'duplicates': 0}
+
+
+def test_loss_is_credited_back_when_the_packet_arrives_late():
+    tracker = SequenceTracker()
+    assert accept_all(tracker, [1, 2, 4, 5]) == [True, True, True, True]
+    assert tracker.lost == 1
+    assert tracker.accept(3) is False
+    assert tracker.get_counters() == {'received': 5, 'lost': 0, 'reordered': 1,
+                                      'duplicates': 0}
+
+
+def test_duplicates():
+    tracker = SequenceTracker()
+    assert accept_all(tracker, [1, 2, 2, 1]) == [True, True, False, False]
+    assert tracker.get_counters() == {'received': 2, 'lost': 0, 'reordered': 0,
+                                      'duplicates': 2}
+
+
+def test_packet_before_the_first_is_not_credited():
+    tracker = SequenceTracker()
+    assert accept_all(tracker, [2, 1]) == [True, False]
+    assert tracker.get_counters() == {'received': 2, 'lost': 0, 'reordered': 1,
+                                      'duplicates': 0}
+    # A repeat of it is a duplicate
+    assert tracker.accept(1) is False
+    assert tracker.duplicates == 1
+
+
+def test_large_gap_restarts_the_window():
+    tracker = SequenceTracker()
+    tracker.accept(1)
+    assert tracker.accept(1000) is True
+    assert tracker.lost == 998
+    # Lost packets far behind the window cannot be told from duplicates
+    assert tracker.accept(10) is False
+    assert tracker.lost == 998
+    assert tracker.accept(999) is False
+    assert tracker.lost == 997
+
+
+def test_huge_gap_and_wraparound():
+    tracker = SequenceTracker()
+    tracker.accept(1)
+    # More than half the sequence space ahead is older, not a huge loss
+    assert tracker.accept(protocol.SEQ_MASK) is False
+    assert tracker.lost == 0
+
+    tracker = SequenceTracker()
+    assert accept_all(tracker, [protocol.SEQ_MASK - 1, protocol.SEQ_MASK, 0, 1]) == [True] * 4
+    assert tracker.get_counters() == {'received': 4, 'lost': 0, 'reordered': 0,
+                                      'duplicates': 0}
+
+
+def test_reset():
+    tracker = SequenceTracker()
+    accept_all(tracker, [100, 102])
+    tracker.reset()
+    assert tracker.accept(1) is True
+    assert tracker.get_counters() == {'received': 1, 'lost': 0, 'reordered': 0,
+                                      'duplicates': 0}
+
+
+def test_add_ee_pose():
+    states = protocol.add_ee_pose({'ee_position': np.array([1.0, 2.0, 3.0]),
+                                   'ee_orientation': np.array([0.0, 0.0, 0.0, 1.0])})
+    assert states['ee_pose'].tolist() == [1.0, 2.0, 3.0, 0.0, 0.0, 0.0, 1.0]
+    assert 'ee_pose' not in protocol.add_ee_pose({'ee_position': np.zeros(3)})
+    assert 'ee_pose' not in protocol.DEFAULT_STATE_FIELDS
@@ -0,0 +1,203 @@
+"""On-disk cache of parsed command files for sendcomm.py.
+
+Parsing a long text command file takes a noticeable fraction of a second.
+TrajectoryCache stores each parsed file as a binary trajectory file (see
+trajectory_file.save_trajectory) named by the SHA-256 hash of the text, so
+loading the same content again is a single memory map. The hash of each
+source file is remembered together with its mtime and size, so unchanged
+files are not even re-read to hash them.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+
+import trajectory_file
+
+# Default cache location and size limit
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'robot_trajectories')
+DEFAULT_MAX_SIZE = 1 << 30
+
+INDEX_NAME = 'index.json'
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def file_digest(filename):
+    """SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class TrajectoryCache:
+    """Cache of parsed command files in a directory, limited in total size.
+
+    Entries are evicted least recently used first once their total size
+    exceeds max_size. Files whose waypoints differ in length cannot be
+    stored as one array and are not cached; the index remembers them, so
+    later loads fail at once instead of parsing them again.
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_size=DEFAULT_MAX_SIZE):
+        """Initialize the cache, creating its directory if needed.
+
+        Args:
+            directory: Cache directory (default: DEFAULT_DIRECTORY)
+            max_size: Total size of the cached trajectories in bytes (default: 1 GiB)
+        """
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, INDEX_NAME)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.uncacheable = 0
+
+    def _entry_path(self, digest):
+        return os.path.join(self.directory, digest + trajectory_file.BINARY_SUFFIX)
+
+    def _read_index(self):
+        """Source path -> {'mtime_ns', 'size', 'digest'} of the files loaded so far.
+
+        Entries of files that could not be cached also have 'uncacheable'.
+        """
+        try:
+            with open(self._index_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        self._atomic_write(self._index_path, lambda f: f.write(json.dumps(index).encode()))
+
+    def _atomic_write(self, path, write):
+        """Write a file through a temporary file, so readers never see it partially written."""
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def _digest(self, filename, index):
+        """Content digest of a source file, reusing the indexed one if mtime and size match."""
+        key = os.path.abspath(filename)
+        stat = os.stat(filename)
+        entry = index.get(key)
+        if entry and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return entry['digest']
+        digest = file_digest(filename)
+        index[key] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'digest': digest}
+        self._write_index(index)
+        return digest
+
+    def load(self, filename):
+        """Load a command file from the cache, parsing and storing it on a miss.
+
+        Args:
+            filename: Path to a text command file (optionally .gz or .xz compressed)
+
+        Returns:
+            tuple: (control_mode, values, times) as returned by
+                trajectory_file.load_trajectory; memory-mapped on a hit
+
+        Raises:
+            ValueError: If the file cannot be loaded as arrays (e.g. its
+                waypoints differ in length), also on later loads of the same content
+        """
+        index = self._read_index()
+        digest = self._digest(filename, index)
+        entry = index[os.path.abspath(filename)]
+        if entry.get('uncacheable'):
+            self.uncacheable += 1
+            raise ValueError(f"{filename} cannot be loaded as arrays and is not cached")
+        path = self._entry_path(digest)
+        try:
+            control_mode, values, times, _ = trajectory_file.open_trajectory(path)
+        except (FileNotFoundError, ValueError, zipfile.BadZipFile):
+            pass
+        else:
+            # Mark as recently used for eviction
+            os.utime(path)
+            self.hits += 1
+            return control_mode, values, times
+
+        self.misses += 1
+        try:
+            control_mode, values, times = trajectory_file.load_trajectory(filename)
+        except ValueError:
+            entry['uncacheable'] = True
+            self._write_index(index)
+            raise
+        self._atomic_write(path, lambda f: trajectory_file.save_trajectory(
+            f, control_mode, values, times, source=os.path.abspath(filename)))
+        self._evict(keep=path)
+        return control_mode, values, times
+
+    def _entries(self):
+        """Cached trajectory files as (last use, size, path), least recently used first."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(trajectory_file.BINARY_SUFFIX):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def _evict(self, keep=None):
+        """Remove least recently used entries until the cache fits in max_size."""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        evicted = set()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            if path == keep:
+                continue
+            os.unlink(path)
+            evicted.add(path)
+            total -= size
+            self.evictions += 1
+        if evicted:
+            index = self._read_index()
+            self._write_index({source: entry for source, entry in index.items()
+                               if self._entry_path(entry['digest']) not in evicted})
+
+    def size(self):
+        """Total size of the cached trajectories in bytes."""
+        return sum(size for _, size, _ in self._entries())
+
+    def invalidate(self, filename=None):
+        """Drop the cached trajectory of a command file, or of all files.
+
+        Args:
+            filename: Path to the command file (default: clear the whole cache)
+        """
+        index = self._read_index()
+        if filename is None:
+            for _, _, path in self._entries():
+                os.unlink(path)
+            index = {}
+        else:
+            entry = index.pop(os.path.abspath(filename), None)
+            if entry is None:
+                return
+            if os.path.exists(self._entry_path(entry['digest'])):
+                os.unlink(self._entry_path(entry['digest']))
+        self._write_index(index)
+
+    def get_counters(self):
+        """Get cache counters.
+
+        Returns:
+            dict: Hits, misses, evictions, loads of uncacheable files and
+                total size in bytes
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'uncacheable': self.uncacheable, 'size': self.size()}
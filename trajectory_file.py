@@ -0,0 +1,398 @@
+"""Loading of command files (see commands.txt) as NumPy arrays for sendcomm.py.
+
+A command file holds the control mode on its first non-comment line and one
+waypoint per line after it, as comma-separated values. The control mode line
+may name a leading time column, which then holds each waypoint's time in
+seconds, either absolute ('time', on any clock) or since the previous
+waypoint ('dt'):
+
+    joint_position, time
+    0.0, 0.0, -0.785, 0.0, -2.356, 0.0, 1.571, 0.785
+    0.5, 0.2, -0.785, 0.0, -2.356, 0.0, 1.571, 0.785
+
+Loaders return absolute times in both cases; 'dt' values are summed, counting
+the first from time 0.
+
+Waypoints are parsed by np.loadtxt in one pass into a contiguous (N, D)
+float64 array, so whole trajectories can be validated, interpolated and
+encoded as arrays.
+
+Long trajectories can be converted once to a binary trajectory file: an
+uncompressed .npz archive (readable by np.load) holding a JSON 'header'
+(control mode and metadata), the 'values' array and optionally 'times'.
+Loading one memory-maps the arrays instead of reading them, so streaming
+starts immediately and pages are read from disk as they are sent.
+
+Text command files may be gzip (.gz) or xz (.xz) compressed. CommandFileReader
+reads any of these formats lazily, one waypoint or chunk at a time, so
+arbitrarily large files are streamed in constant memory.
+"""
+import gzip
+import itertools
+import json
+import lzma
+import os
+import struct
+import sys
+import warnings
+import zipfile
+
+import numpy as np
+
+# Names of the leading time column on the control mode line: absolute times,
+# or seconds since the previous waypoint
+TIME_COLUMN = 'time'
+DELTA_TIME_COLUMN = 'dt'
+
+# Suffix and version of binary trajectory files
+BINARY_SUFFIX = '.npz'
+BINARY_VERSION = 1
+
+# Fixed part of a zip local file header; the name and extra field lengths end it
+ZIP_LOCAL_HEADER = struct.Struct('<4s5H3I2H')
+
+
+def _parse_mode_line(line):
+    """Split a control mode line into (control_mode, time column name or None)."""
+    fields = [field.strip().lower() for field in line.split(',')]
+    if len(fields) == 1:
+        return fields[0], None
+    if len(fields) == 2 and fields[1] in (TIME_COLUMN, DELTA_TIME_COLUMN):
+        return fields[0], fields[1]
+    raise ValueError(f"Invalid control mode line: {line!r}")
+
+
+def _open_text(filename):
+    """Open a command file as text, decompressing .gz and .xz files."""
+    name = str(filename)
+    if name.endswith('.gz'):
+        return gzip.open(filename, 'rt')
+    if name.endswith('.xz'):
+        return lzma.open(filename, 'rt')
+    return open(filename, 'r')
+
+
+def _load_rows(f):
+    """Parse the remaining waypoint rows of an open command file, skipping comments.
+
+    Args:
+        f: Text file positioned after the control mode line
+
+    Returns:
+        np.ndarray: float64 array of shape (rows, columns); no rows if there are none
+    """
+    with warnings.catch_warnings():
+        # A file without waypoints is reported by the callers, not worth a warning
+        warnings.simplefilter('ignore', UserWarning)
+        return np.loadtxt(f, dtype=np.float64, delimiter=',', comments='#', ndmin=2)
+
+
+def _data_lines(f):
+    """Yield the non-blank lines of an open command file, without comments."""
+    for line in f:
+        if '#' in line:
+            line = line.split('#', 1)[0]
+        line = line.strip()
+        if line:  # Skip empty lines and comments
+            yield line
+
+
+def _read_mode(f, filename):
+    """Read up to and including the control mode line of an open command file."""
+    line = next(_data_lines(f), None)
+    if line is None:
+        raise ValueError(f"No control mode in {filename}")
+    return _parse_mode_line(line)
+
+
+def load_trajectory(filename):
+    """Load a command file into arrays.
+
+    All waypoints must have the same number of values; read_commands also
+    accepts files that mix lengths (e.g. ee_position with and without
+    orientation). Binary trajectory files (BINARY_SUFFIX) are memory-mapped,
+    see open_trajectory.
+
+    Args:
+        filename: Path to the commands file
+
+    Returns:
+        tuple: (control_mode, values, times) where values is a C-contiguous
+            float64 array of shape (N, D) and times an array of shape (N,), or
+            None if the file has no time column
+    """
+    if str(filename).endswith(BINARY_SUFFIX):
+        control_mode, values, times, _ = open_trajectory(filename)
+        return control_mode, values, times
+
+    with _open_text(filename) as f:
+        control_mode, time_column = _read_mode(f, filename)
+        # The rest of the file, parsed in one call
+        data = _load_rows(f)
+
+    if time_column is None:
+        return control_mode, np.ascontiguousarray(data), None
+    if data.shape[1] < 2:
+        raise ValueError(f"{filename}: expected a time column and command values")
+    times = data[:, 0]
+    times = np.cumsum(times) if time_column == DELTA_TIME_COLUMN else np.ascontiguousarray(times)
+    return control_mode, np.ascontiguousarray(data[:, 1:]), times
+
+
+def read_commands(filename):
+    """Read a command file line by line into lists.
+
+    Slower than load_trajectory, but waypoints may differ in length.
+
+    Args:
+        filename: Path to the commands file
+
+    Returns:
+        tuple: (control_mode, list of command value lists, list of times or
+            None if the file has no time column)
+    """
+    commands = []
+    times = []
+    with _open_text(filename) as f:
+        control_mode, time_column = _read_mode(f, filename)
+        for line in _data_lines(f):
+            values = [float(x.strip()) for x in line.split(',')]
+            if time_column is not None:
+                times.append(values.pop(0))
+            commands.append(values)
+    if time_column is None:
+        return control_mode, commands, None
+    if time_column == DELTA_TIME_COLUMN:
+        times = list(itertools.accumulate(times))
+    return control_mode, commands, times
+
+
+def save_trajectory(filename, control_mode, values, times=None, **metadata):
+    """Write a binary trajectory file.
+
+    Args:
+        filename: Path of the file to write (should end in BINARY_SUFFIX), or a
+            binary file object
+        control_mode: Type of command ('joint_position', 'ee_position', etc.)
+        values: Waypoints, shape (N, D)
+        times: Time of each waypoint in seconds, shape (N,) (optional)
+        **metadata: Additional JSON-serializable header entries
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim != 2:
+        raise ValueError(f"Expected waypoints of shape (N, D), got {values.shape}")
+    header = dict(metadata, version=BINARY_VERSION, control_mode=control_mode)
+    arrays = {'header': np.array(json.dumps(header)), 'values': values}
+    if times is not None:
+        arrays['times'] = np.asarray(times, dtype=np.float64)
+        if arrays['times'].shape != (len(values),):
+            raise ValueError(f"Expected {len(values)} times, got shape {arrays['times'].shape}")
+    # Stored uncompressed, so open_trajectory can map the arrays
+    if hasattr(filename, 'write'):
+        np.savez(filename, **arrays)
+        return
+    with open(filename, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+def _map_member(path, archive, name):
+    """Memory-map an array stored uncompressed in an .npz archive."""
+    info = archive.getinfo(f"{name}.npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        with archive.open(info) as member:
+            return np.lib.format.read_array(member)
+
+    with open(path, 'rb') as f:
+        f.seek(info.header_offset)
+        fields = ZIP_LOCAL_HEADER.unpack(f.read(ZIP_LOCAL_HEADER.size))
+        name_length, extra_length = fields[-2:]
+        f.seek(info.header_offset + ZIP_LOCAL_HEADER.size + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    if dtype.hasobject:
+        raise ValueError(f"{path}: {name} holds Python objects")
+    if 0 in shape:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+def open_trajectory(filename):
+    """Open a binary trajectory file with its arrays memory-mapped.
+
+    Args:
+        filename: Path to the trajectory file
+
+    Returns:
+        tuple: (control_mode, values, times, header) where values and times
+            are read-only memory maps (times None if the file has none) and
+            header is the metadata dictionary
+    """
+    with zipfile.ZipFile(filename) as archive:
+        names = set(archive.namelist())
+        if 'header.npy' not in names or 'values.npy' not in names:
+            raise ValueError(f"{filename} is not a trajectory file")
+        with archive.open('header.npy') as member:
+            header = json.loads(str(np.lib.format.read_array(member, allow_pickle=False)))
+        if header.get('version') != BINARY_VERSION:
+            raise ValueError(f"{filename}: unsupported trajectory file version "
+                             f"{header.get('version')}")
+        values = _map_member(filename, archive, 'values')
+        times = _map_member(filename, archive, 'times') if 'times.npy' in names else None
+    return header['control_mode'], values, times, header
+
+
+class CommandFileReader:
+    """Lazy reader of a command file, binary trajectory file or compressed command file.
+
+    Waypoints are parsed only as they are requested, either one at a time
+    (iterating the reader) or as NumPy chunks (chunks()), so memory use does
+    not grow with the file and the first waypoints are available as soon as
+    the control mode line and the first chunk have been read. A reader can be
+    iterated once.
+
+    Like read_commands, text files may mix waypoint lengths: a chunk ends
+    where the length changes, so each chunk is still one (n, D) array.
+    """
+
+    # Rows parsed at a time when iterating waypoint by waypoint
+    ITER_CHUNK_SIZE = 1024
+
+    def __init__(self, filename):
+        """Open a command file and read its control mode and first waypoint.
+
+        Args:
+            filename: Path to a command file (optionally .gz or .xz compressed)
+                or a binary trajectory file (BINARY_SUFFIX)
+        """
+        self.filename = filename
+        self._file = None
+        self._mapped = None
+        self._lines = None
+        # Line read ahead that starts the next chunk, and its number of fields
+        self._next_line = None
+        self._next_width = None
+        # Sum of the 'dt' values read so far
+        self._elapsed = 0.0
+        if str(filename).endswith(BINARY_SUFFIX):
+            self.control_mode, values, times, _ = open_trajectory(filename)
+            self._mapped = (values, times)
+            self.time_column = None if times is None else TIME_COLUMN
+            self.dim = values.shape[1]
+        else:
+            self._file = _open_text(filename)
+            self.control_mode, self.time_column = _read_mode(self._file, filename)
+            self._lines = _data_lines(self._file)
+            # Read ahead one line to learn the number of values of the first waypoint
+            self._read_ahead()
+            self.dim = None if self._next_line is None else self._next_width - self.timed
+
+    @property
+    def timed(self):
+        """Whether the waypoints have times."""
+        return self.time_column is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        """Yield (time, values) per waypoint; time is None without a time column."""
+        for values, times in self.chunks(self.ITER_CHUNK_SIZE):
+            for i in range(len(values)):
+                yield (None if times is None else times[i]), values[i]
+
+    def _read_ahead(self):
+        self._next_line = next(self._lines, None)
+        if self._next_line is not None:
+            self._next_width = self._next_line.count(',') + 1
+
+    def _rows(self, count):
+        """Parse up to count more rows of the same length, starting with the line read ahead."""
+        if self._next_line is None:
+            return np.empty((0, 0))
+        width = self._next_width
+        lines = [self._next_line]
+        self._read_ahead()
+        while len(lines) < count and self._next_line is not None and self._next_width == width:
+            lines.append(self._next_line)
+            self._read_ahead()
+        rows = np.loadtxt(lines, dtype=np.float64, delimiter=',', ndmin=2)
+        if self.timed and width < 2:
+            raise ValueError(f"{self.filename}: expected a time column and command values")
+        return rows
+
+    def chunks(self, chunk_size):
+        """Yield the waypoints in chunks.
+
+        Args:
+            chunk_size: Waypoints per chunk; the last chunk, and chunks ending
+                where the waypoint length changes, may be shorter
+
+        Yields:
+            tuple: (values, times) with values of shape (n, D) and absolute
+                times of shape (n,), or None without a time column
+        """
+        if chunk_size < 1:
+            raise ValueError(f"Chunk size must be at least 1, got {chunk_size}")
+        if self._mapped is not None:
+            values, times = self._mapped
+            for first in range(0, len(values), chunk_size):
+                yield (values[first:first + chunk_size],
+                       None if times is None else times[first:first + chunk_size])
+            return
+
+        while True:
+            rows = self._rows(chunk_size)
+            if not len(rows):
+                return
+            if self.time_column == DELTA_TIME_COLUMN:
+                times = self._elapsed + np.cumsum(rows[:, 0])
+                self._elapsed = times[-1]
+                yield rows[:, 1:], times
+            elif self.timed:
+                yield rows[:, 1:], rows[:, 0]
+            else:
+                yield rows, None
+
+    def close(self):
+        """Close the underlying file."""
+        if self._file is not None:
+            self._file.close()
+        self._mapped = None
+
+
+def convert_commands_file(source, destination=None):
+    """Convert a text command file to a binary trajectory file.
+
+    Args:
+        source: Path to the commands file (optionally .gz or .xz compressed)
+        destination: Path of the trajectory file (default: source with
+            BINARY_SUFFIX in place of its extension)
+
+    Returns:
+        str: Path of the written trajectory file
+    """
+    if destination is None:
+        stem = str(source)
+        if stem.endswith(('.gz', '.xz')):
+            stem = stem[:-3]
+        destination = os.path.splitext(stem)[0] + BINARY_SUFFIX
+    control_mode, values, times = load_trajectory(source)
+    save_trajectory(destination, control_mode, values, times, source=str(source))
+    return destination
+
+
+if __name__ == "__main__":
+    # Usage: python trajectory_file.py commands.txt [commands.npz]
+    if len(sys.argv) not in (2, 3):
+        sys.exit("Usage: python trajectory_file.py <commands file> [<trajectory file>]")
+    written = convert_commands_file(*sys.argv[1:])
+    print(f"Wrote {written}")
@@ -0,0 +1,276 @@
+"""Message transports used by sendcomm.py (server) and getcomm_controlrob.py (client).
+
+A transport carries whole messages (the datagrams of protocol.py) between the
+server and its clients. The server and client are written against the
+Transport interface, so the same code runs over:
+- UdpTransport: UDP datagrams (the default, works across machines)
+- UnixDatagramTransport: AF_UNIX datagram sockets (same host, no IP stack)
+- TcpTransport: length-prefixed messages over TCP (reliable, ordered)
+- shm_transport.SharedMemoryTransport: shared memory rings (same host)
+"""
+import abc
+import errno
+import os
+import selectors
+import socket
+import stat
+import struct
+import threading
+import time
+from collections import deque
+
+
+class Transport(abc.ABC):
+    """Interface of a message transport.
+
+    Addresses identify peers: the server passes the address a message came
+    from to send() to reply to that client; clients have a single peer and
+    may omit it.
+    """
+
+    @abc.abstractmethod
+    def send(self, data, address=None):
+        """Send one message.
+
+        Args:
+            data: Message bytes (bytes, bytearray or memoryview)
+            address: Peer address (default: the transport's only peer)
+        """
+
+    @abc.abstractmethod
+    def recv(self, buffer, timeout=None):
+        """Receive one message into a preallocated buffer.
+
+        A message longer than the buffer is truncated to fit, as datagram
+        sockets do.
+
+        Args:
+            buffer: Writable buffer (e.g. a bytearray) large enough for a message
+            timeout: Seconds to wait; None waits forever, 0 only checks (default: None)
+
+        Returns:
+            tuple: (number of bytes written to buffer, sender address), or
+                None if no message arrived within timeout
+        """
+
+    @abc.abstractmethod
+    def close(self):
+        """Release the transport's resources."""
+
+    def fileno(self):
+        """File descriptor that becomes readable when messages arrive, or -1 if none."""
+        return -1
+
+
+class _SocketTransport(Transport):
+    """Transport over a bound datagram socket."""
+
+    def __init__(self, sock, peer=None):
+        self.sock = sock
+        self.peer = peer
+
+    def send(self, data, address=None):
+        self.sock.sendto(data, self.peer if address is None else address)
+
+    def recv(self, buffer, timeout=None):
+        self.sock.settimeout(timeout)
+        try:
+            return self.sock.recvfrom_into(buffer)
+        except (socket.timeout, BlockingIOError):
+            # A zero timeout makes the socket non-blocking
+            return None
+
+    def close(self):
+        self.sock.close()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+
+class UdpTransport(_SocketTransport):
+    """UDP datagrams; the original transport of the protocol."""
+
+    def __init__(self, host='0.0.0.0', port=0, peer=None):
+        """Bind a UDP socket.
+
+        Args:
+            host: Address to bind (default: '0.0.0.0')
+            port: Port to bind (default: 0, any free port)
+            peer: (host, port) of the only peer, for clients (optional)
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((host, port))
+        super().__init__(sock, peer)
+
+
+class UnixDatagramTransport(_SocketTransport):
+    """AF_UNIX datagram sockets, for a server and client on the same host.
+
+    Each side binds its own socket path; addresses are socket paths.
+    """
+
+    def __init__(self, path, peer=None):
+        """Bind a Unix datagram socket.
+
+        Args:
+            path: Socket path to bind; a stale socket file (no longer bound)
+                is replaced, but any other file there raises FileExistsError
+                and a socket still in use raises OSError (EADDRINUSE)
+            peer: Socket path of the only peer, for clients (optional)
+        """
+        try:
+            mode = os.stat(path).st_mode
+        except FileNotFoundError:
+            pass
+        else:
+            if not stat.S_ISSOCK(mode):
+                raise FileExistsError(f"{path} exists and is not a socket")
+            self._check_stale(path)
+            os.unlink(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(path)
+        self.path = path
+        # Identifies our socket file, so close() leaves a replacement alone
+        self._inode = os.stat(path).st_ino
+        super().__init__(sock, peer)
+
+    @staticmethod
+    def _check_stale(path):
+        """Raise unless the socket file at path is stale (connecting is refused)."""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as probe:
+            try:
+                probe.connect(path)
+            except ConnectionRefusedError:
+                return
+        raise OSError(errno.EADDRINUSE, f"{path} is bound by a running socket", path)
+
+    def close(self):
+        super().close()
+        try:
+            status = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if stat.S_ISSOCK(status.st_mode) and status.st_ino == self._inode:
+            os.unlink(self.path)
+
+
+class TcpTransport(Transport):
+    """Messages over TCP, each prefixed with its length.
+
+    As a server it accepts any number of clients and identifies each by its
+    connection's peer address; as a client it connects to the server.
+    Messages are delivered reliably and in order, at the cost of head-of-line
+    blocking after a loss.
+    """
+
+    FRAME = struct.Struct('<I')
+    RECV_SIZE = 65536
+
+    def __init__(self, host='0.0.0.0', port=5000, server=False):
+        """Listen for clients (server) or connect to the server (client).
+
+        Args:
+            host: Address to bind (server) or server address (client)
+            port: Port to bind (server) or server port (client)
+            server: Listen rather than connect (default: False)
+        """
+        self._selector = selectors.DefaultSelector()
+        self._connections = {}
+        self._pending = {}
+        self._messages = deque()
+        self._send_lock = threading.Lock()
+        self._listener = None
+        self.peer = None
+
+        if server:
+            self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._listener.bind((host, port))
+            self._listener.listen()
+            self._selector.register(self._listener, selectors.EVENT_READ)
+        else:
+            self.peer = (host, port)
+            self._add_connection(socket.create_connection(self.peer), self.peer)
+
+    def _add_connection(self, conn, address):
+        # Messages are small and latency-critical: do not wait to coalesce them
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._connections[address] = conn
+        self._pending[address] = bytearray()
+        self._selector.register(conn, selectors.EVENT_READ, address)
+
+    def _drop_connection(self, address):
+        conn = self._connections.pop(address)
+        self._pending.pop(address)
+        self._selector.unregister(conn)
+        conn.close()
+
+    def send(self, data, address=None):
+        conn = self._connections.get(self.peer if address is None else address)
+        if conn is None:
+            raise ConnectionError(f"Not connected to {address}")
+        with self._send_lock:
+            conn.sendall(self.FRAME.pack(len(data)) + bytes(data))
+
+    def _read(self, address):
+        """Read from a connection and queue the complete messages received."""
+        conn = self._connections[address]
+        try:
+            data = conn.recv(self.RECV_SIZE)
+        except ConnectionError:
+            data = b''
+        if not data:
+            self._drop_connection(address)
+            return
+        pending = self._pending[address]
+        pending += data
+        offset = 0
+        while len(pending) - offset >= self.FRAME.size:
+            length = self.FRAME.unpack_from(pending, offset)[0]
+            end = offset + self.FRAME.size + length
+            if len(pending) < end:
+                break
+            self._messages.append((address, bytes(pending[offset + self.FRAME.size:end])))
+            offset = end
+        del pending[:offset]
+
+    def recv(self, buffer, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._messages:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+            events = self._selector.select(remaining)
+            for key, _ in events:
+                if key.fileobj is self._listener:
+                    conn, address = self._listener.accept()
+                    self._add_connection(conn, address)
+                else:
+                    self._read(key.data)
+            if not events and deadline is not None and time.monotonic() >= deadline:
+                return None
+
+        address, message = self._messages.popleft()
+        # Truncate like a datagram socket: resizing the buffer would fail while
+        # the caller holds a memoryview of it
+        nbytes = min(len(message), len(buffer))
+        buffer[:nbytes] = message[:nbytes]
+        return nbytes, address
+
+    def close(self):
+        for address in list(self._connections):
+            self._drop_connection(address)
+        if self._listener is not None:
+            self._selector.unregister(self._listener)
+            self._listener.close()
+        self._selector.close()
+
+    def fileno(self):
+        """File descriptor of the selector watching the listener and all connections.
+
+        Readable when data or a connection arrives on any of them, but not
+        while complete messages that already arrived wait in the queue, so
+        call recv(buffer, 0) until it returns None before waiting on it. -1
+        where the platform's selector has no descriptor (select() based).
+        """
+        if not hasattr(self._selector, 'fileno'):
+            return -1
+        return self._selector.fileno()